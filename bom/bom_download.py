@@ -1,24 +1,55 @@
 import ftplib
 import os
-# connect to the FTP server
-ftp = ftplib.FTP('ftp.bom.gov.au')
-ftp.login()
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
-# navigate to the directory you want to list
-ftp.cwd('/anon/gen/radar')
+ftp_host = 'ftp.bom.gov.au'
+radar_dir = '/anon/gen/radar'
+max_connections = 8
 
 locations = ["IDR664", "IDR713"]
 
+# every download thread keeps its own control connection open and reuses it
+thread_data = threading.local()
+connections = []
+connections_lock = threading.Lock()
+
+def connect():
+    ftp = ftplib.FTP(ftp_host)
+    ftp.login()
+    # navigate to the directory you want to list
+    ftp.cwd(radar_dir)
+    return ftp
+
+def get_thread_ftp():
+    if getattr(thread_data, 'ftp', None) is None:
+        thread_data.ftp = connect()
+        with connections_lock:
+            connections.append(thread_data.ftp)
+    return thread_data.ftp
+
+def download_file(job):
+    file, file_path = job
+    ftp = get_thread_ftp()
+    #save the file
+    with open(file_path, 'wb') as f:
+        ftp.retrbinary('RETR ' + file, f.write)
+    print(file)
+
+# connect to the FTP server
+ftp = connect()
+
 # list the files in the directory
 files = ftp.nlst()
+ftp.quit()
 
+jobs = []
 for location in locations:
-   
+
 
     for file in files:
         # does the file include the text IDR664 and end with .png?
         if location in file and file.endswith('.png'):
-            print(file)
             date = file[9:17]
             year = date[0:4]
             month = date[4:6]
@@ -35,9 +66,12 @@ for location in locations:
                 print(f"File already exists: {folder_path + file}")
                 continue
 
+            jobs.append((file, folder_path + file))
+
+# download the missing files over a small pool of parallel FTP connections
+with ThreadPoolExecutor(max_workers=max_connections) as executor:
+    list(executor.map(download_file, jobs))
 
-            # close the FTP connection
-            #save the file
-            with open(folder_path + file, 'wb') as f:
-                ftp.retrbinary('RETR ' + file, f.write)
-ftp.quit()
\ No newline at end of file
+# close the FTP connections
+for connection in connections:
+    connection.quit()
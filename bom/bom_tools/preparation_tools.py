@@ -1,13 +1,13 @@
 # a method that is a recursive directory reader
 
-import math
 import os
-from pathlib import Path
+from functools import lru_cache, partial
 import pickle
 import shutil
+import tempfile
 import cv2
 import numpy as np
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from tqdm import tqdm
 # Hyperparameters
 image_segment_split = 8
@@ -16,51 +16,56 @@ image_round_percent = 5
 
 scratch_pad = "./data/scratch"
 base_path = "./data/train_bom_3"
+# parsed percents survive between runs here (outside scratch_pad, which gets cleared), one file per split
+def get_percent_cache_file(seg = image_segment_split):
+    return f"./data/percent_cache_{seg}.npz"
+
+percent_cache_file = get_percent_cache_file()
+# set BOM_DUMP=1 to have image_parser write every segment and a preview of its percents to scratch_pad
+debug_dump = os.environ.get("BOM_DUMP") == "1"
+# dumps are only for looking at, so trade file size for encode speed
+dump_png_params = [cv2.IMWRITE_PNG_COMPRESSION, 1]
+dump_writer = None
+
+def walk_pngs(path):
+    # DirEntry.is_dir() reuses what the directory listing already returned, so no extra stat per entry
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_dir():
+                yield from walk_pngs(entry.path)
+            elif entry.name.endswith(".png"):
+                yield entry.path
 
 def recursive_directory_reader(path):
-    
+    return list(walk_pngs(path))
 
-    return [str(f) for f in Path(path).rglob("*.png")]
 
+@lru_cache(maxsize=8)
+def get_percent_table(segment_height, segment_width):
+    # a segment's percent depends only on its non-transparent pixel count, so for a
+    # given segment size every possible count is mapped to its percent once
+    percentages = (np.arange(segment_height * segment_width + 1) / (segment_height * segment_width)) * 100
 
-def calculate_non_transparent_percentage(image):
-    
-    # If the image has 4 channels, assume it's in BGRA format
-    if image.shape[2] == 4:
-        # Alpha channel is the 4th channel
-        alpha_channel = image[:, :, 3]
-
-        # Count non-zero (i.e., non-transparent) pixels in the alpha channel
-        non_transparent_pixels = np.count_nonzero(alpha_channel)
-
-        # Total pixels in the image
-        total_pixels = alpha_channel.size
-
-        # Calculate percentage
-        non_transparent_percentage = (non_transparent_pixels / total_pixels) * 100
-        
-        if non_transparent_percentage < 10:
-            non_transparent_percentage = 0
-        
-        #round non_transparent_percentage to nearest 5%
-        
-        
-        
-    else:
-        # If image doesn't have an alpha channel, it's fully opaque
-        non_transparent_percentage = 100
+    # anything under 10% counts as empty
+    percentages[percentages < 10] = 0
+
+    # round down to the nearest int, then down to the nearest image_round_percent
+    percentages = np.floor(np.floor(percentages) / image_round_percent) * image_round_percent
+    return percentages.astype(int)
 
+def calculate_non_transparent_percentage(image):
     
+    # If image doesn't have an alpha channel, it's fully opaque
+    if image.shape[2] != 4:
+        return 100
 
-    #round up non_transparent_percentage to nearest int
-    non_transparent_percentage =  math.floor(non_transparent_percentage)
-    #non_transparent_percentage = non_transparent_percentage / 100
-    non_transparent_percentage = math.floor(non_transparent_percentage / image_round_percent) * image_round_percent
+    # Alpha channel is the 4th channel (BGRA)
+    alpha_channel = image[:, :, 3]
 
-    # if(non_transparent_percentage > 20):
-    #     print(f"non_transparent_percentage: {non_transparent_percentage}")
+    # Count non-zero (i.e., non-transparent) pixels in the alpha channel
+    non_transparent_pixels = np.count_nonzero(alpha_channel)
 
-    return non_transparent_percentage
+    return int(get_percent_table(*alpha_channel.shape)[non_transparent_pixels])
 
 def percentages_to_image(percents, seg = image_segment_split):
     percentages = np.array(percents)
@@ -86,28 +91,17 @@ def tidy_image(image):
     # Create a new image to hold the output
     output_image = np.zeros_like(image)
 
-    # Iterate over the image
-    for i in range(image_segment_split):
-        for j in range(image_segment_split):
-            # Find the bounds of the current segment
-            start_i = i * segment_height
-            end_i = (i+1) * segment_height
-            start_j = j * segment_width
-            end_j = (j+1) * segment_width
-
-            # Extract the segment from the image
-            segment = image[start_i:end_i, start_j:end_j]
-
-            # Count the number of non-black pixels
-            non_black_pixels = np.sum(segment > 0)
-
-            # If less than 5% of the pixels are non-black
-            if non_black_pixels < 0.10 * segment_width * segment_height:
-                # Set the segment to black
-                output_image[start_i:end_i, start_j:end_j] = 0
-            else:
-                # Otherwise, copy the original segment
-                output_image[start_i:end_i, start_j:end_j] = segment
+    # View the image as a (split, segment_height, split, segment_width) grid of segments
+    grid_height = image_segment_split * segment_height
+    grid_width = image_segment_split * segment_width
+    segments = image[:grid_height, :grid_width].reshape(image_segment_split, segment_height, image_segment_split, segment_width)
+
+    # Count the number of non-black pixels in every segment at once
+    non_black_pixels = np.count_nonzero(segments > 0, axis=(1, 3))
+
+    # Segments with less than 10% non-black pixels are set to black, the rest are copied
+    keep = non_black_pixels >= 0.10 * segment_width * segment_height
+    output_image[:grid_height, :grid_width] = np.where(keep[:, None, :, None], segments, 0).reshape(grid_height, grid_width)
 
     return output_image
 
@@ -118,19 +112,20 @@ def tidy_image(image):
 def image_parser(file, seg = image_segment_split):
     #print(file)
     
-    # open the file with opencv
-    img = cv2.imread(file, cv2.IMREAD_UNCHANGED)
+    # read the whole file in one go and let opencv decode it from memory
+    # (the IMREAD_REDUCED_* modes would drop the alpha channel we measure, and for
+    # PNG they still inflate the full image before downscaling, so decode it unchanged)
+    try:
+        buf = np.fromfile(file, dtype=np.uint8)
+    except OSError:
+        return None
+    img = cv2.imdecode(buf, cv2.IMREAD_UNCHANGED) if buf.size else None
     if(img is None):
         #print(f"Dead: {file}")
         return None
     filename_nopath = os.path.basename(file)
     
     img[:16,:] = 0
-    
-    threshold = np.all(img[..., :3] < [5, 5, 5], axis=2)
-
-    # For every pixel that is close to black, we set its alpha value to 0
-    img[threshold] = (0, 0, 0, 0)
 
     # get the height and width of the image
     height, width, channels = img.shape
@@ -146,56 +141,72 @@ def image_parser(file, seg = image_segment_split):
     if segment_width * horizontal_segments != width or segment_height * vertical_segments != height:
         raise ValueError('The number of horizontal/vertical segments must divide the image perfectly.')
 
-    # initialize an array to hold the image segments
-    image_segments = []
+    # no alpha channel means every segment is fully opaque
+    if channels != 4:
+        return [100] * (vertical_segments * horizontal_segments)
 
-    # split the image into segments
-    for i in range(vertical_segments):
-        for j in range(horizontal_segments):
-            # calculate the boundaries of the segment
-            x_start = j * segment_width
-            y_start = i * segment_height
-            x_end = (j+1) * segment_width
-            y_end = (i+1) * segment_height
+    # mask pixels that are close to black (every colour channel below 5)
+    threshold = cv2.inRange(np.ascontiguousarray(img[..., :3]), (0, 0, 0), (4, 4, 4))
 
-            # slice the image to create the segment
-            segment = img[y_start:y_end, x_start:x_end]
-            
-            # append the segment to the list
-            image_segments.append(segment)
+    # For every pixel that is close to black, we set its alpha value to 0
+    # (only alpha is measured, so the colour channels are left alone)
+    img[..., 3][threshold != 0] = 0
 
-    percents = []
+    # count the non-transparent pixels of every segment: an INTER_AREA resize by a whole
+    # factor averages each segment of the 0/1 alpha mask exactly, and is much quicker than
+    # a numpy reduction over the (seg, seg_h, seg, seg_w) view once the segments get small
+    alpha = cv2.threshold(cv2.extractChannel(img, 3), 0, 1, cv2.THRESH_BINARY)[1].astype(np.float32)
+    coverage = cv2.resize(alpha, (horizontal_segments, vertical_segments), interpolation=cv2.INTER_AREA)
+    counts = np.rint(coverage * (segment_height * segment_width)).astype(np.int64)
 
-    # save the segments
-    for i in range(len(image_segments)):
-        # get the segment
-        segment = image_segments[i]
-        file_name = os.path.join(scratch_pad, filename_nopath + "_" + str(i) + ".png")
-        #ensure the path for file_name exists
-        #cv2.imwrite(file_name, segment)
-        percent = calculate_non_transparent_percentage(segment)
-        percents.append(percent)
-    
-    # #print(percents)
-    # percentages = np.array(percents)
-    # percentages = np.ceil(10 * percentages) / 100.0
+    percents = get_percent_table(segment_height, segment_width)[counts].ravel().tolist()
 
-    # # Clip values to the valid range for safety
-    # percentages = np.clip(percentages, 0, 1)
+    if debug_dump:
+        dump_segments(img, percents, filename_nopath, seg, segment_height, segment_width)
 
-    # # Reshape to 3x3 and convert to grayscale image
-    # img_small = np.reshape(percentages, (seg, seg))
+    return percents
 
-    # # Convert small image to 8-bit grayscale image (range 0-255)
-    # img_small = (img_small * 255).astype(np.uint8)
+def dump_segments(img, percents, filename_nopath, seg, segment_height, segment_width):
+    prefix = os.path.join(scratch_pad, filename_nopath)
 
-    # # Upscale using nearest neighbor interpolation (to avoid blending values)
-    # img_large = cv2.resize(img_small, (seg * 128, seg * 128), interpolation = cv2.INTER_NEAREST)
-    # out_file = os.path.join(scratch_pad, filename_nopath + "_large.png")
+    # save the segments
+    for i in range(seg):
+        for j in range(seg):
+            segment = img[i * segment_height:(i + 1) * segment_height, j * segment_width:(j + 1) * segment_width]
+            submit_dump(f"{prefix}_{i * seg + j}.png", segment)
+
+    # scale to 0-1 (percents are never negative, so only the top needs clipping), then
+    # straight to a seg x seg 8-bit grayscale image (range 0-255) in one expression
+    img_small = (np.minimum(np.ceil(10 * np.asarray(percents)) / 100.0, 1) * 255).astype(np.uint8).reshape(seg, seg)
+
+    # Upscale by an exact factor of 128 by repeating pixels (nearest neighbour, no blending)
+    img_large = img_small.repeat(128, axis=0).repeat(128, axis=1)
+    out_file = f"{prefix}_large.png"
     # Save the image
-    #cv2.imwrite(out_file, img_large)
-    
-    return percents
+    submit_dump(out_file, img_large)
+
+def write_dump(path, image):
+    # imencode releases the GIL, so the dump threads encode in parallel with the caller
+    ok, buf = cv2.imencode('.png', image, dump_png_params)
+    if ok:
+        with open(path, 'wb', buffering=1 << 16) as f:
+            f.write(buf)
+
+def submit_dump(path, image):
+    # started lazily (along with scratch_pad) so normal runs never spin up the writer
+    # threads; pending writes are joined at interpreter exit
+    global dump_writer
+    if dump_writer is None:
+        os.makedirs(scratch_pad, exist_ok=True)
+        dump_writer = ThreadPoolExecutor(max_workers=4)
+    dump_writer.submit(write_dump, path, image)
+
+def _reset_dump_writer():
+    # a forked worker inherits the executor but not its threads, so it needs its own
+    global dump_writer
+    dump_writer = None
+
+os.register_at_fork(after_in_child=_reset_dump_writer)
 
 def get_scratch():
     return scratch_pad
@@ -233,17 +244,17 @@ def encode(text_array):
     return lines_array_int
 
 def decode(ints):
-    output = ""
-    for i in ints:
-        if i == 1:
-            output += "\n"
-        else:
-            output += f"{i:09d}"
+    return "".join(["\n" if i == 1 else f"{i:09d}" for i in ints])
 
-    return output
+def init_parser_worker():
+    # each worker process already gets its own core, so keep OpenCV from fanning out further
+    cv2.setNumThreads(1)
 
-def image_parser_wrapper(file):
-    percents = image_parser(file)
+def get_parser_chunksize(count, workers):
+    return max(1, count // (workers * 4))
+
+def image_parser_wrapper(file, seg = image_segment_split):
+    percents = image_parser(file, seg)
     return percents if percents is not None else 'No Result'
 
 def get_vocabs():   
@@ -267,41 +278,140 @@ def local_encode(s, stoi):
 def local_decode(l, itos):
         return ''.join([itos[i] for i in l]) # decoder: take a list of integers, output a string
     
+def get_stoi_lookup(stoi):
+    # the vocab is fixed for a run, so each distinct stoi only builds its table once
+    return _build_stoi_lookup(tuple(stoi.items()))
+
+@lru_cache(maxsize=8)
+def _build_stoi_lookup(stoi_items):
+    # token ids indexed by percent value, with one extra slot for the newline token
+    newline_slot = 101
+    lookup = np.full(newline_slot + 1, -1, dtype=np.int64)
+    for ch, i in stoi_items:
+        if ch.isdigit() and int(ch) < newline_slot:
+            lookup[int(ch)] = i
+    lookup[newline_slot] = dict(stoi_items)['\n']
+    # shared between callers, so make sure nobody edits it in place
+    lookup.flags.writeable = False
+    return lookup, newline_slot
+
 def encode_lines(lines, stoi):
-    result_ids = []
-    for i in lines:
-        #split local_encode(i) by ' '
-        splits =i.split(' ') 
-        for s in splits:
-            if s == '':
-                continue
-            
-            result_ids.append(local_encode(s, stoi))
-        
-        result_ids.append(local_encode('\n', stoi))
-        
-    return result_ids
+    if len(lines) == 0:
+        return np.array([], dtype=np.int64)
 
-def get_percents(files):
-    all_percents = []
+    lookup, newline_slot = get_stoi_lookup(stoi)
 
-    
-    
+    # parse every percent in one pass, with a newline marker closing each line
+    separator = f" {newline_slot} "
+    values = np.fromstring(separator.join(lines) + separator, dtype=np.int64, sep=' ')
 
-    with ThreadPoolExecutor(max_workers=16) as executor:
-        results = list(tqdm(executor.map(image_parser_wrapper, files), total=len(files)))
+    invalid = (values < 0) | (values > newline_slot)
+    result_ids = lookup[np.where(invalid, 0, values)]
+    invalid |= result_ids < 0
+    if invalid.any():
+        raise KeyError(str(values[invalid][0]))
 
+    return result_ids
+
+def encode_percents(all_percents, stoi, dtype=np.int64):
+    # same ids as encode_lines(get_percents_string(all_percents).splitlines(), stoi),
+    # gathered straight from the integer percents without formatting them first
+    if len(all_percents) == 0:
+        return np.array([], dtype=dtype)
+
+    lookup, newline_slot = get_stoi_lookup(stoi)
+
+    percents = np.asarray(all_percents, dtype=np.int64)
+    invalid = (percents < 0) | (percents >= newline_slot)
+    if not invalid.any():
+        invalid = lookup[percents] < 0
+    if invalid.any():
+        raise KeyError(str(percents[invalid][0]))
+
+    # every image is its percents followed by a newline token, written straight into the output dtype
+    result_ids = np.empty((percents.shape[0], percents.shape[1] + 1), dtype=dtype)
+    result_ids[:, :-1] = lookup[percents]
+    result_ids[:, -1] = lookup[newline_slot]
+    return result_ids.ravel()
+
+def write_ids(ids, path, chunk_bytes=16 << 20):
+    # stream through a 1 MiB buffered file in ~16 MB slices rather than one huge write
+    chunk = max(1, chunk_bytes // ids.itemsize)
+    with open(path, 'wb', buffering=1 << 20) as f:
+        for start in range(0, len(ids), chunk):
+            f.write(memoryview(ids[start:start + chunk]))
+
+def _percent_cache_key(file):
+    # a changed file gets a new mtime/size and so misses the cache
+    try:
+        stat = os.stat(file)
+    except OSError:
+        return None
+    return f"{file}|{stat.st_mtime_ns}|{stat.st_size}"
+
+def load_percent_cache(cache_file = percent_cache_file):
+    if not os.path.exists(cache_file):
+        return {}
+    # it's only a cache, so a truncated or otherwise unreadable file just means parsing everything again
+    try:
+        with np.load(cache_file) as cache:
+            return dict(zip(cache['keys'].tolist(), cache['percents'].tolist()))
+    except Exception as e:
+        print(f"Warning: ignoring unreadable percent cache {cache_file}: {e}")
+        return {}
+
+def save_percent_cache(cache, cache_file = percent_cache_file):
+    cache_dir = os.path.dirname(cache_file) or "."
+    os.makedirs(cache_dir, exist_ok=True)
+    keys = np.array(list(cache.keys()), dtype=str)
+    percents = np.array(list(cache.values()), dtype=np.uint8).reshape(len(cache), -1 if cache else 0)
+    # write next to the cache and rename over it, so an interrupted or concurrent run never leaves half a file
+    fd, tmp_file = tempfile.mkstemp(dir=cache_dir, suffix=".npz.tmp")
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.savez_compressed(f, keys=keys, percents=percents)
+        os.replace(tmp_file, cache_file)
+    except BaseException:
+        os.unlink(tmp_file)
+        raise
+
+def parse_percents(files, seg = image_segment_split):
+    # percents for every file in order, 'No Result' where the image couldn't be read
+    cache_file = get_percent_cache_file(seg)
+    cache = load_percent_cache(cache_file)
+    keys = [_percent_cache_key(file) for file in files]
+    missing = [(file, key) for file, key in zip(files, keys) if key not in cache]
+    missing_files = [file for file, key in missing]
+
+    # decode + reduce is CPU bound, so use processes and hand them files in chunks
+    workers = os.cpu_count() or 1
+    chunksize = get_parser_chunksize(len(missing_files), workers)
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_parser_worker) as executor:
+        results = list(tqdm(executor.map(partial(image_parser_wrapper, seg=seg), missing_files, chunksize=chunksize), total=len(missing_files)))
+
+    parsed = {}
+    cache_updated = False
+    for (file, key), result in zip(missing, results):
+        parsed[key] = result
+        if key is not None and result != 'No Result':
+            cache[key] = result
+            cache_updated = True
+
+    # keep only entries for the files as they are now, so renamed, deleted or changed files don't pile up
+    current = {key: cache[key] for key in keys if key in cache}
+    if cache_updated or len(current) < len(cache):
+        save_percent_cache(current, cache_file)
+
+    return [cache[key] if key in cache else parsed[key] for key in keys]
+
+def get_percents(files):
+    results = parse_percents(files)
 
     all_percents = [result for result in results if result != 'No Result']
     
     return all_percents
 
 def get_percents_string(all_percents):
-    bigstring = ""
-    
-    for img_percent in all_percents:
-        for percent in img_percent:
-            bigstring += f"{percent} "
-        bigstring += "\n"
-    
-    return bigstring
\ No newline at end of file
+    # one "p p p \n" line per image, joined once rather than grown a token at a time
+    return "".join(["".join([f"{percent} " for percent in img_percent]) + "\n" for img_percent in all_percents])
\ No newline at end of file
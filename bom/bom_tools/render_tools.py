@@ -1,39 +1,78 @@
 import os
+import shutil
 import cv2
 import imageio
 import numpy as np
-from skimage.transform import resize
-from bom_tools.upscale_model import transform_input, get_model
+import torch
+from pygifsicle import gifsicle
+from bom_tools.upscale_model import get_model
 from bom_tools.preparation_tools import image_segment_split, percentages_to_image
 
-def render_gif(files, target, duration=100):
+def render_gif(frames, target, duration=100):
+    # frames can be image file paths or already decoded numpy arrays
     # create the animation
     with imageio.get_writer(target, mode='I', duration=duration, loop=0) as writer:
         try:
-            for file in files:
-                image = imageio.imread(file)
+            for frame in frames:
+                image = imageio.imread(frame) if isinstance(frame, (str, os.PathLike)) else frame
                 writer.append_data(image)
         except Exception as e:
             print(f"An error occurred: {e}")
 
-model = None
+gif_colors = 64
+
+def optimize_gif(target, colors=gif_colors):
+    # re-encode with a smaller palette and only the changed pixels of each frame
+    # gifsicle is an external binary, so leave the gif as rendered where it isn't installed
+    if shutil.which('gifsicle') is None:
+        return
+    gifsicle(target, colors=colors, options=['--optimize=3'])
 
 rescale_size = 128
+upscale_batch_size = 256
+scratch_png_params = [cv2.IMWRITE_PNG_COMPRESSION, 1]
+# picked on the first upscale, so importing this module (e.g. just for join_gifs) doesn't touch CUDA
+upscale_dtype = None
+
+def get_upscale_dtype():
+    global upscale_dtype
+    if upscale_dtype is None:
+        upscale_dtype = torch.bfloat16 if torch.cuda.is_bf16_supported() else torch.float16
+        # let cuDNN pick the fastest ConvTranspose2d algorithm for our fixed input shapes
+        torch.backends.cudnn.benchmark = True
+    return upscale_dtype
+
+# pinned host / device input buffers, reused across calls instead of allocating per batch
+staging_host = None
+staging_device = None
+
+def get_staging_buffers(batch_size):
+    global staging_host, staging_device
+    if staging_host is None or staging_host.shape[0] < batch_size:
+        shape = (max(batch_size, upscale_batch_size), 1, image_segment_split, image_segment_split)
+        staging_host = torch.empty(shape, dtype=torch.float32, pin_memory=True)
+        staging_device = torch.empty_like(staging_host, device='cuda')
+    return staging_host[:batch_size], staging_device[:batch_size]
+
+def upscale_images(images, model=None):
+    if model is None:
+        model = get_model(rescale_size)
+    host_batch, batch = get_staging_buffers(len(images))
+    # stack the 8x8 frames into one (N, 1, 8, 8) batch, scaled the same way as ToTensor
+    host_batch.copy_(torch.from_numpy(np.stack(images)[:, None])).div_(255.0)
+    batch.copy_(host_batch, non_blocking=True)
+    with torch.inference_mode(), torch.autocast('cuda', dtype=get_upscale_dtype()):
+        scored = model.decode(batch)
+    scored = scored.float().cpu().numpy().reshape(-1, rescale_size, rescale_size, 1)
+
+    upscaled_images = []
+    for reshaped_img in scored:
+        reshaped_img = (255.0 / reshaped_img.max() * (reshaped_img - reshaped_img.min())).astype(np.uint8)
+        upscaled_images.append(reshaped_img)
+    return upscaled_images
 
 def upscale_image(image):
-    model = get_model(rescale_size)
-    img = np.array(image)
-    img = transform_input(img)
-    to_score = img.reshape(-1, 8*8)
-    to_score = img.reshape(-1, 1, 8, 8)
-    to_score = to_score.to('cuda')
-    scored = model.decode(to_score)
-    reshaped_img = scored[0].cpu().detach().numpy().reshape(rescale_size, rescale_size, 1)
-    reshaped_img = (255.0 / reshaped_img.max() * (reshaped_img - reshaped_img.min())).astype(np.uint8)
-
-    # print(reshaped_img.shape)
-    # exit()
-    return reshaped_img
+    return upscale_images([image])[0]
 
 def render_bigstring(bigstring, target, scratch, clear_files=False, repeat=1, original_amount=0):
     
@@ -45,48 +84,49 @@ def render_bigstring(bigstring, target, scratch, clear_files=False, repeat=1, or
     
     lines = bigstring.splitlines()
     
-    files = []
+    images = []
     for line_num, line in enumerate(lines):
         line = line.strip()
         percents = [int(p) for p in line.split(' ')]
         
         image = percentages_to_image(percents)
         
-        # np_percent = np.array(percents)
-        
-        # np_percent = np_percent
-        # np_matrix = np.reshape(np_percent, (image_segment_split, image_segment_split))
-        # #print (np_matrix)
+        # np_matrix = np.reshape(np.array(percents), (image_segment_split, image_segment_split))
+
+        # # fill each 128x128 segment with the corresponding percentage in one tile expansion
+        # fill = (np_matrix * 255 // 100).astype(np.uint8)
+        # fill = np.repeat(np.repeat(fill, 128, axis=0), 128, axis=1)
         # image = np.zeros((image_segment_split * 128, image_segment_split * 128, 3), dtype=np.uint8)
 
-        # # fill each segment with the corresponding percentage
-        # for j in range(image_segment_split):
-        #     for i in range(image_segment_split):
-        #         x = i * 128
-        #         y = j * 128
-        #         w = 128
-        #         h = 128
-        #         fill = int(np_matrix[j, i] / 100 * 255)
-                
-        #         if line_num > original_amount and original_amount > 0:
-        #             cv2.rectangle(image, (x, y), (x + w, y + h), (fill, 0, 0), -1)
-        #         else:                
-        #             cv2.rectangle(image, (x, y), (x + w, y + h), (fill, fill, fill), -1)  # grayscale
-
-        upscaled_image = upscale_image(image)
-        resized_image = cv2.resize(upscaled_image, (1024, 1024))
-        # save the image
-        for i in range(repeat):
-            image_save_path = os.path.join(scratch_path, str(line_num) + "_" + str(i) + ".png")
-            files.append(image_save_path)
-            cv2.imwrite(image_save_path, resized_image)
-        
-        
-    render_gif(files, target)
-    if clear_files:
-        # remove all files in files
-        for file in files:
-            os.remove(file)
+        # if line_num > original_amount and original_amount > 0:
+        #     image[:, :, 0] = fill
+        # else:
+        #     image[:] = fill[:, :, None]  # grayscale
+
+        images.append(image)
+
+    model = get_model(rescale_size)
+
+    def render_frames():
+        # run the decoder over batches of frames rather than one frame per launch
+        for batch_start in range(0, len(images), upscale_batch_size):
+            upscaled_images = upscale_images(images[batch_start:batch_start + upscale_batch_size], model)
+            for batch_num, upscaled_image in enumerate(upscaled_images):
+                line_num = batch_start + batch_num
+                resized_image = cv2.resize(upscaled_image, (1024, 1024))
+                # frames that are cleared afterwards never need to touch the disk
+                if not clear_files:
+                    # favour encode speed over size, and encode once even when the frame is repeated
+                    _, encoded_image = cv2.imencode('.png', resized_image, scratch_png_params)
+                    # save the image
+                    for i in range(repeat):
+                        image_save_path = os.path.join(scratch_path, str(line_num) + "_" + str(i) + ".png")
+                        encoded_image.tofile(image_save_path)
+                for i in range(repeat):
+                    yield resized_image
+
+    # hand the frames straight to the gif writer instead of re-reading the PNGs
+    render_gif(render_frames(), target)
     
 
 """
@@ -113,7 +153,7 @@ def join_gifs(gif_paths, output_path, duration=0.3):
         frames = [gif[frame_index] for gif in gif_images]
 
         # Resize frames to have the same height
-        frames = [resize(frame, (max_height, frame.shape[1]), mode='reflect', preserve_range=True).astype(np.uint8) for frame in frames]
+        frames = [cv2.resize(frame, (frame.shape[1], max_height), interpolation=cv2.INTER_LINEAR) for frame in frames]
 
         # Concatenate frames side by side and append to output frames list
         output_images.append(np.concatenate(frames, axis=1))
@@ -37,6 +37,8 @@ class UpscaleModel(torch.nn.Module):
 
 model = None
 
+compile_decoder = True  # use PyTorch 2.0 to fuse the decoder's conv/bn/relu kernels
+
 
 def transform_input(input):
 	transform = torchvision.transforms.Compose([
@@ -51,4 +53,7 @@ def get_model(rescale_size):
     model = UpscaleModel()
     model.load_state_dict(torch.load(f'./bom/encoders/RADAR_UPSCALER_{rescale_size}.pth'))
     model = model.to('cuda')
+    model.eval()
+    if compile_decoder:
+        model.decoder = torch.compile(model.decoder)
     return model
@@ -5,7 +5,7 @@ import pickle
 import shutil
 import cv2
 import numpy as np
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ProcessPoolExecutor
 # Hyperparameters
 
 image_segment_split = 3
@@ -14,7 +14,7 @@ scratch_pad = "./data/scratch"
 base_path = "./data/train_bom_3"
 
 
-from bom_tools.preparation_tools import encode_lines, encode, recursive_directory_reader, calculate_non_transparent_percentage, scratch_pad, base_path, image_segment_split, _clear_scratch, image_parser_wrapper
+from bom_tools.preparation_tools import get_percents_string, encode_percents, encode, recursive_directory_reader, calculate_non_transparent_percentage, scratch_pad, base_path, image_segment_split, _clear_scratch, image_parser_wrapper, init_parser_worker, get_parser_chunksize
 #main 
 if __name__ == "__main__":
     # get the current working directory
@@ -45,25 +45,19 @@ if __name__ == "__main__":
     #         continue
     #     all_percents.append(percents)
 
-    with ThreadPoolExecutor(max_workers=16) as executor:
-        results = executor.map(image_parser_wrapper, files)
+    # parsing is CPU bound, so use processes rather than threads
+    workers = os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_parser_worker) as executor:
+        results = list(executor.map(image_parser_wrapper, files, chunksize=get_parser_chunksize(len(files), workers)))
 
     all_percents = [result for result in results if result != 'No Result']
 
     # print (all_percents)
 
-    bigstring = ""
-
-    for img_percent in all_percents:
-        for percent in img_percent:
-            bigstring += f"{percent} "
-        bigstring += "\n"
+    bigstring = get_percents_string(all_percents)
     # print (bigstring)
 
-    lines = bigstring.splitlines()
-    
-    
-    ids = encode_lines(lines, stoi)
+    ids = encode_percents(all_percents, stoi)
     
     print(ids)
     
@@ -8,7 +8,7 @@ import numpy as np
 from concurrent.futures import ThreadPoolExecutor
 # Hyperparameters
 
-from bom_tools.preparation_tools import get_percents, encode_lines, encode, get_vocabs, local_encode, recursive_directory_reader, calculate_non_transparent_percentage, scratch_pad, base_path, image_segment_split, _clear_scratch, image_parser_wrapper
+from bom_tools.preparation_tools import get_percents, get_percents_string, encode_percents, encode, get_vocabs, local_encode, recursive_directory_reader, calculate_non_transparent_percentage, scratch_pad, base_path, image_segment_split, _clear_scratch, image_parser_wrapper, write_ids, debug_dump
 
 
 
@@ -40,18 +40,13 @@ if __name__ == "__main__":
 
     # print (all_percents)
 
-    bigstring = ""
+    # the percents are encoded straight to ids, so the text form is only built for debugging
+    if debug_dump:
+        bigstring = get_percents_string(all_percents)
 
-    for img_percent in all_percents:
-        for percent in img_percent:
-            bigstring += f"{percent} "
-        bigstring += "\n"
-    
-    # save bigstring to file`
-    with open(os.path.join(scratch_path, 'bigstring.txt'), 'w') as f:
-        f.write(bigstring)
-
-    lines = bigstring.splitlines()
+        # save bigstring to file`
+        with open(os.path.join(scratch_path, 'bigstring.txt'), 'w') as f:
+            f.write(bigstring)
 
     
 
@@ -66,28 +61,25 @@ if __name__ == "__main__":
     # with open(os.path.join(scratch_path, 'bigstring_encoded.txt'), 'w') as f:
     #     f.write(bigstring_ids)
 
-    total_lines = len(lines)
+    total_lines = len(all_percents)
 
     split_index = int(total_lines * 0.9)  # Calculate the index where to split
 
-    train_data = lines[:split_index]
-    val_data = lines[split_index:]
+    train_data = all_percents[:split_index]
+    val_data = all_percents[split_index:]
 
     # n = len(all_ids)
     # train_data = all_ids[:int(n*0.9)]
     # val_data = all_ids[int(n*0.9):]
 
     # Ensure teh percentages are encoded as a unit, not per char, e.g. 99 not 9 and 9 separately
-    train_ids = encode_lines(train_data, stoi)
-    val_ids = encode_lines(val_data, stoi)
+    train_ids = encode_percents(train_data, stoi, dtype=np.uint16)
+    val_ids = encode_percents(val_data, stoi, dtype=np.uint16)
     
 
     # num_copies = 1000
-    # train_data_repeated = [x for x in train_ids for _ in range(num_copies)]
-    # val_data_repeated = [x for x in val_ids for _ in range(num_copies)]
-
-    train_ids = np.array(train_ids).astype(np.uint16)
-    val_ids = np.array(val_ids).astype(np.uint16)
+    # train_data_repeated = np.repeat(train_ids, num_copies)
+    # val_data_repeated = np.repeat(val_ids, num_copies)
 
     print(f"train has {len(train_ids):,} tokens")
     print(f"val has {len(val_ids):,} tokens")
@@ -96,8 +88,8 @@ if __name__ == "__main__":
     if not os.path.exists(base_path):
         os.makedirs(base_path)
 
-    train_ids.tofile(os.path.join(base_path, 'train.bin'))
-    val_ids.tofile(os.path.join(base_path, 'val.bin'))
+    write_ids(train_ids, os.path.join(base_path, 'train.bin'))
+    write_ids(val_ids, os.path.join(base_path, 'val.bin'))
 
     # save the meta information as well, to help us encode/decode later
     meta = {
@@ -106,4 +98,4 @@ if __name__ == "__main__":
         'stoi': stoi,
     }
     with open(os.path.join(base_path, 'meta.pkl'), 'wb') as f:
-        pickle.dump(meta, f)
+        pickle.dump(meta, f, protocol=pickle.HIGHEST_PROTOCOL)
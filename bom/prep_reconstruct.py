@@ -2,23 +2,15 @@ from concurrent.futures import ThreadPoolExecutor
 import os
 import subprocess
 import numpy as np
-from tqdm import tqdm
-import concurrent.futures
-
-import pickle
 
 import cv2
-from bom_tools.preparation_tools import get_scratch, percentages_to_image, image_parser, get_percents_string, get_percents, encode_lines, encode, get_vocabs, local_encode, recursive_directory_reader, calculate_non_transparent_percentage, scratch_pad, base_path, image_segment_split, _clear_scratch, image_parser_wrapper, tidy_image
+from bom_tools.preparation_tools import get_scratch, percentages_to_image, get_percents_string, get_percents, encode_lines, encode, get_vocabs, local_encode, recursive_directory_reader, calculate_non_transparent_percentage, scratch_pad, base_path, image_segment_split, _clear_scratch, image_parser_wrapper, tidy_image, parse_percents
 from bom_tools.render_tools import join_gifs, render_gif, render_bigstring
 
 resize_size = 128
 
 
-def process_file(file):
-
-    file_percent = image_parser(file)
-    if file_percent is None:
-        return None
+def process_percents(file_percent, high_res_percent):
 
     parsed_image = percentages_to_image(file_percent)
 
@@ -31,7 +23,6 @@ def process_file(file):
     # # save with cv2
     # cv2.imwrite(file_save, parsed_image)
     parsed_image = tidy_image(parsed_image)
-    high_res_percent = image_parser(file, resize_size)
     high_parsed_image = percentages_to_image(high_res_percent, resize_size)
     return (parsed_image, high_parsed_image)
 
@@ -48,17 +39,22 @@ if __name__ == "__main__":
     # get first 1000 files
     # files = files[:200]
 
-    with concurrent.futures.ProcessPoolExecutor(max_workers=16) as executor:
-        img_pairs = list(
-            tqdm(executor.map(process_file, files), total=len(files)))
-
-    img_pairs = [img for img in img_pairs if img is not None]
-    # save img_pairs using pickle
+    # both splits are read through the on-disk percent caches, so a rerun only
+    # decodes files that are new or have changed since the last run
+    file_percents = parse_percents(files)
+    high_res_percents = parse_percents(files, resize_size)
 
-    # convert teh image pairs to np.arrays
-    img_pairs_np = [(np.array(img[0]), np.array(img[1])) for img in img_pairs]
+    img_pairs = [process_percents(file_percent, high_res_percent)
+                 for file_percent, high_res_percent in zip(file_percents, high_res_percents)
+                 if file_percent != 'No Result' and high_res_percent != 'No Result']
+    # every pair has the same shapes, so save the low and high res images as two stacked
+    # arrays rather than pickling a list of small ones (np.load can also mmap them)
+    low_images = np.stack([img[0] for img in img_pairs]) if img_pairs else np.empty((0, image_segment_split, image_segment_split), dtype=np.uint8)
+    high_images = np.stack([img[1] for img in img_pairs]) if img_pairs else np.empty((0, resize_size, resize_size), dtype=np.uint8)
 
     # now run torchvision.transforms.ToTensor() on each of the images
 
-    with open(os.path.join("./data", f'img_pairs_{resize_size}.pkl'), 'wb') as f:
-        pickle.dump(img_pairs_np, f)
+    with open(os.path.join("./data", f'img_pairs_{resize_size}_low.npy'), 'wb', buffering=1 << 20) as f:
+        np.save(f, low_images, allow_pickle=False)
+    with open(os.path.join("./data", f'img_pairs_{resize_size}_high.npy'), 'wb', buffering=1 << 20) as f:
+        np.save(f, high_images, allow_pickle=False)
@@ -1,21 +1,14 @@
 from concurrent.futures import ThreadPoolExecutor
 import os
-import subprocess
+import sys
+import numpy as np
 from bom_tools.preparation_tools import get_percents_string, get_percents, encode_lines, encode, get_vocabs, local_encode, recursive_directory_reader, calculate_non_transparent_percentage, scratch_pad, base_path, image_segment_split, _clear_scratch, image_parser_wrapper
-from bom_tools.render_tools import join_gifs, render_gif, render_bigstring
+from bom_tools.render_tools import join_gifs, render_gif, render_bigstring, optimize_gif
 
 
-def run_process(command):
-    """
-    Runs a shell command and returns the output as a string.
-    """
-    process = subprocess.Popen(
-        command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True)
-    output, error = process.communicate()
-    if error:
-        raise Exception(
-            f"Command '{command}' failed with error: {error.decode('utf-8')}")
-    return output.decode('utf-8')
+# sample_bom.py lives in the repo root, next to model.py
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from sample_bom import run
 
 
 starters = [
@@ -50,13 +43,18 @@ if __name__ == "__main__":
 
     files = recursive_directory_reader(render_path)
 
-    files = sorted(files)
+    # frames are named by their number, so order them numerically (a plain string sort puts 1000.png before 336.png)
+    frame_numbers = np.array([int(os.path.splitext(os.path.basename(f))[0]) for f in files], dtype=np.int64)
+    order = np.argsort(frame_numbers, kind='stable')
+    files = [files[i] for i in order]
+    frame_numbers = frame_numbers[order]
 
-    # find the index of the file that contains the starter string
-    index = next((i for i, f in enumerate(files) if starter in f), None)
+    # find the index of the starter frame
+    starter_number = int(os.path.splitext(starter)[0])
+    index = np.searchsorted(frame_numbers, starter_number)
 
     # return all files after and including the starter file
-    files = files[index:] if index is not None else []
+    files = files[index:] if index < len(files) and frame_numbers[index] == starter_number else []
 
     gif1 = os.path.join(scratch, "orig_animation.gif")
     gif2 = os.path.join(scratch, "percents_orig_animation.gif")
@@ -81,37 +79,37 @@ if __name__ == "__main__":
     with open(prompt_file, "w") as f:
         f.write(prompt_lines)
 
-    # run a python program python sample_bom.py --out_dir=out-trainbom-3 --start={prompt_file}
-    command = f"python sample_bom.py --out_dir=out-trainbom-3 --start=FILE:{prompt_file} --save_to={result_file}"
-    run_process(command)
+    # sample in process rather than through python sample_bom.py, so the model stays loaded between runs
+    # run hands back the decoded sample, result_file is still written but doesn't need reading back
+    score_lines = run(out_dir='out-trainbom-3', start=f'FILE:{prompt_file}', save_to=result_file) or ""
 
-    score_lines = ""
-    # read result_file
-    with open(result_file, "r") as f:
-        score_lines = f.read()
-
-    # read each line in score_lines, split it by spaces and validate that it has 9 elements
-
-    valid_score_lines = []
-    for line in score_lines.splitlines():
-        score = line.split()
-        if len(score) != image_segment_split * image_segment_split:
-            continue
-        valid_score_lines.append(line)
+    # read each line in score_lines, split it by spaces and validate that it has a percent for every segment
+    segment_count = image_segment_split * image_segment_split
+    valid_score_lines = [line for line in score_lines.splitlines() if len(line.split()) == segment_count]
 
     print('\n'.join(valid_score_lines))
 
     # get len(valid_score_lines) lines from teh start of bigstring
     original_lines = bigstring.splitlines()[:len(valid_score_lines)]
-    render_bigstring("\n".join(valid_score_lines), gif5,
-                     scratch, True, 1, prompt_number)
-    render_bigstring("\n".join(original_lines), gif6, scratch, True, 1)
-    join_gifs([gif6, gif5], gif7)
-
-    # render originals and things
-    render_gif(files, gif1)
-
-    render_bigstring(bigstring, gif2, scratch)
-    render_bigstring(prompt_lines, gif4, scratch)
-
-    join_gifs([gif1, gif2], gif3)
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        # the original frames never touch the GPU, so read and encode them alongside the bigstring renders
+        orig_render = executor.submit(render_gif, files, gif1)
+
+        # the bigstring renders share the upscale model and its staging buffers, so they stay on this thread
+        render_bigstring("\n".join(valid_score_lines), gif5,
+                         scratch, True, 1, prompt_number)
+        render_bigstring("\n".join(original_lines), gif6, scratch, True, 1)
+        predictions_join = executor.submit(join_gifs, [gif6, gif5], gif7)
+
+        # render originals and things
+        render_bigstring(bigstring, gif2, scratch)
+        render_bigstring(prompt_lines, gif4, scratch)
+
+        orig_render.result()
+        join_gifs([gif1, gif2], gif3)
+        predictions_join.result()
+
+    # shrink every gif once nothing needs to read it back, the joins stack decoded frames and
+    # frames that only carry their changed pixels can decode with a different channel layout
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        list(executor.map(optimize_gif, [gif1, gif2, gif3, gif4, gif5, gif6, gif7]))
@@ -303,11 +303,13 @@ class GPT(nn.Module):
         return mfu
 
     @torch.no_grad()
-    def generate(self, idx, max_new_tokens, temperature=1.0, top_k=None):
+    def generate(self, idx, max_new_tokens, temperature=1.0, top_k=None, top_k_method='topk'):
         """
         Take a conditioning sequence of indices idx (LongTensor of shape (b,t)) and complete
         the sequence max_new_tokens times, feeding the predictions back into the model each time.
         Most likely you'll want to make sure to be in model.eval() mode of operation for this.
+        top_k_method picks how the top_k cutoff is found: 'topk' or 'kthvalue' (a selection
+        without sorting the kept logits, which can be quicker for a large top_k on cpu).
         """
         for _ in range(max_new_tokens):
             # if the sequence context is growing too long we must crop it at block_size
@@ -316,10 +318,15 @@ class GPT(nn.Module):
             logits, _ = self(idx_cond)
             # pluck the logits at the final step and scale by desired temperature
             logits = logits[:, -1, :] / temperature
-            # optionally crop the logits to only the top k options
-            if top_k is not None:
-                v, _ = torch.topk(logits, min(top_k, logits.size(-1)))
-                logits[logits < v[:, [-1]]] = -float('Inf')
+            # optionally crop the logits to only the top k options, nothing to crop if k covers the whole vocab
+            if top_k is not None and top_k < logits.size(-1):
+                if top_k_method == 'kthvalue':
+                    # the k-th largest logit is the (vocab - k + 1)-th smallest
+                    kth, _ = torch.kthvalue(logits, logits.size(-1) - top_k + 1, dim=-1, keepdim=True)
+                else:
+                    v, _ = torch.topk(logits, top_k)
+                    kth = v[:, [-1]]
+                logits[logits < kth] = -float('Inf')
             # apply softmax to convert logits to (normalized) probabilities
             probs = F.softmax(logits, dim=-1)
             # sample from the distribution
@@ -5,8 +5,8 @@ for stock split/dividend adjustments.
 import pandas as pd
 import numpy as np
 import logging
+import functools
 from pandas.tseries.holiday import USFederalHolidayCalendar
-from pandas.tseries.offsets import CustomBusinessDay
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
@@ -38,6 +38,94 @@ def adjust_prices_for_splits_dividends(df):
     # This is complex and error-prone. Using adjusted data source is preferred.
     return df
 
+@functools.lru_cache(maxsize=32)
+def us_business_days(start, end):
+    """
+    Lists the US business days (weekdays that are not federal holidays) from start to end,
+    the same dates as pd.date_range with a CustomBusinessDay on USFederalHolidayCalendar.
+
+    Args:
+        start (pd.Timestamp): First date. Its time of day is kept on every business day.
+        end (pd.Timestamp): Last date (inclusive).
+
+    Returns:
+        pd.DatetimeIndex: The business days. Cached per (start, end), so callers
+                          must not modify it in place.
+    """
+    # numpy's business day functions work on whole days, so strip the time of day (and time zone) and add it back after
+    tz = start.tz
+    start = start.tz_localize(None)
+    end = end.tz_localize(None)
+    first_day = start.normalize()
+    holidays = USFederalHolidayCalendar().holidays(first_day, end.normalize()).to_numpy().astype('datetime64[D]')
+    days = np.arange(first_day.to_datetime64().astype('datetime64[D]'), end.normalize().to_datetime64().astype('datetime64[D]') + 1)
+    business_days = pd.DatetimeIndex(days[np.is_busday(days, holidays=holidays)].astype('datetime64[ns]')) + (start - first_day)
+    return business_days[business_days <= end].tz_localize(tz)
+
+def find_fill_neighbours(nan_mask, block_starts, block_ends, rows_to_fill):
+    """
+    Finds, for every fillable NaN in a 1-D array of contiguous per-stock blocks,
+    the nearest valid rows before and after it within its own block.
+
+    Args:
+        nan_mask (np.ndarray): Boolean mask of the NaN rows.
+        block_starts (np.ndarray): For each row, the position of its block's first row.
+        block_ends (np.ndarray): For each row, the position one past its block's last row.
+        rows_to_fill (np.ndarray): Boolean mask of the rows that may be filled.
+
+    Returns:
+        tuple: (missing, x, prev_x, next_x, has_prev, has_next), the mask of rows to
+               fill, their positions, their neighbours' positions, and whether each
+               neighbour lies inside the row's block.
+    """
+    missing = nan_mask & rows_to_fill
+
+    # Nearest valid row at or before / at or after every position, in a single pass each way
+    positions = np.arange(len(nan_mask))
+    prev_valid = np.maximum.accumulate(np.where(nan_mask, -1, positions))
+    next_valid = np.minimum.accumulate(np.where(nan_mask, len(nan_mask), positions)[::-1])[::-1]
+
+    x = positions[missing]
+    prev_x = prev_valid[missing]
+    next_x = next_valid[missing]
+    has_prev = prev_x >= block_starts[missing]
+    has_next = next_x < block_ends[missing]
+    return missing, x, prev_x, next_x, has_prev, has_next
+
+def interpolate_within_blocks(values, block_starts, block_ends, rows_to_fill, neighbours=None):
+    """
+    Linearly interpolates NaNs in a 1-D array made of contiguous per-stock blocks,
+    never reading across a block boundary. Leading and trailing NaNs of a block take
+    the nearest valid value, matching interpolate(limit_direction='forward').bfill().
+
+    Args:
+        values (np.ndarray): Column values, NaN where missing.
+        block_starts (np.ndarray): For each row, the position of its block's first row.
+        block_ends (np.ndarray): For each row, the position one past its block's last row.
+        rows_to_fill (np.ndarray): Boolean mask of the rows that may be filled.
+        neighbours (tuple, optional): find_fill_neighbours result for a column with the
+                                      same NaNs, so columns sharing gaps only search once.
+
+    Returns:
+        np.ndarray: Copy of values with the fillable NaNs interpolated.
+    """
+    filled = values.copy()
+    if neighbours is None:
+        neighbours = find_fill_neighbours(np.isnan(values), block_starts, block_ends, rows_to_fill)
+    missing, x, prev_x, next_x, has_prev, has_next = neighbours
+    if not len(x):
+        return filled
+
+    # Same arithmetic as np.interp, done in double precision like pandas
+    prev_y = values[np.where(has_prev, prev_x, 0)].astype(np.float64)
+    next_y = values[np.where(has_next, next_x, 0)].astype(np.float64)
+    both = has_prev & has_next
+    slope = np.divide(next_y - prev_y, next_x - prev_x, out=np.zeros_like(prev_y), where=both)
+    interpolated = np.where(both, slope * (x - prev_x) + prev_y,
+                            np.where(has_prev, prev_y, np.where(has_next, next_y, np.nan)))
+    filled[missing] = interpolated
+    return filled
+
 def handle_missing_trading_days(df):
     """
     Identifies and fills missing trading days within each stock's history
@@ -52,7 +140,6 @@ def handle_missing_trading_days(df):
         pd.DataFrame: DataFrame with missing trading days filled for each stock.
     """
     logging.info("Handling missing trading days...")
-    all_stocks_filled = []
 
     # Handle empty input DataFrame gracefully
     if df.empty:
@@ -61,69 +148,65 @@ def handle_missing_trading_days(df):
 
     original_index_name = df.index.name # Store original index name
 
-    unique_stocks = df['stock_id'].unique()
-    total_stocks = len(unique_stocks)
-
-    # Define US business days, excluding weekends and federal holidays
-    us_business_days = CustomBusinessDay(calendar=USFederalHolidayCalendar())
-
-    for i, stock_id in enumerate(unique_stocks):
-        stock_df = df[df['stock_id'] == stock_id].copy()
-        if stock_df.empty:
-            continue
-
-        logging.debug(f"Processing missing days for {stock_id} ({i+1}/{total_stocks})...")
-
-        # Determine the full date range for this stock based on available data
-        start_date = stock_df.index.min()
-        end_date = stock_df.index.max()
-
-        # Create the expected full range of business days
-        expected_date_range = pd.date_range(start=start_date, end=end_date, freq=us_business_days)
-        expected_date_range.name = original_index_name # Assign name to the new range
-
-        # --- FIX: Remove duplicate index entries before reindexing ---
-        # Keep the first occurrence of duplicate dates
-        if stock_df.index.duplicated().any():
-            num_duplicates = stock_df.index.duplicated().sum()
-            logging.warning(f"Stock ID {stock_id}: Found and removed {num_duplicates} duplicate date entries. Keeping first occurrence.")
-            stock_df = stock_df[~stock_df.index.duplicated(keep='first')]
-        # --- END FIX ---
-
-        # Reindex the DataFrame to include all expected business days, marking missing ones as NaN
-        # The new index will have the name assigned above.
-        stock_df_reindexed = stock_df.reindex(expected_date_range)
-
-        # Forward-fill stock_id for the newly added NaN rows
-        stock_df_reindexed['stock_id'] = stock_id
-
-        # Identify rows that were originally missing
-        missing_rows_mask = stock_df_reindexed['open'].isna() # Check one column like 'open'
-
-        # Interpolate numerical columns (OHLCV)
-        numeric_cols = ['open', 'high', 'low', 'close', 'volume']
-        cols_to_interpolate = [col for col in numeric_cols if col in stock_df_reindexed.columns]
-
-        if not cols_to_interpolate:
-             logging.warning(f"No numeric columns found to interpolate for {stock_id}. Skipping interpolation.")
-        else:
-            if missing_rows_mask.any():
-                 logging.debug(f"Interpolating {missing_rows_mask.sum()} missing trading days for {stock_id}.")
-                 stock_df_reindexed[cols_to_interpolate] = stock_df_reindexed[cols_to_interpolate].interpolate(method='linear', limit_direction='forward', axis=0)
-                 stock_df_reindexed[cols_to_interpolate] = stock_df_reindexed[cols_to_interpolate].bfill(axis=0)
-            else:
-                 logging.debug(f"No missing trading days found for {stock_id}.")
-
-
-        # Drop any remaining rows that couldn't be filled
-        stock_df_filled = stock_df_reindexed.dropna(subset=cols_to_interpolate)
-
-        all_stocks_filled.append(stock_df_filled)
-
-        if (i + 1) % 100 == 0:
-            logging.info(f"Processed missing days for {i+1}/{total_stocks} stocks...")
-
-    if not all_stocks_filled:
+    # Interpolate numerical columns (OHLCV)
+    numeric_cols = ['open', 'high', 'low', 'close', 'volume']
+    cols_to_interpolate = [col for col in numeric_cols if col in df.columns]
+
+    # Build the calendar of US business days (excluding weekends and federal holidays) once for the
+    # whole data set with numpy's vectorised business day mask, each stock slices its range out of it
+    # (repeat runs over the same date range reuse the cached calendar)
+    all_business_days = us_business_days(df.index.min(), df.index.max()).rename(original_index_name)
+
+    # Number the stocks in order of first appearance, rows without a stock_id are left out
+    stock_codes, stock_ids = pd.factorize(df['stock_id'])
+    total_stocks = len(stock_ids)
+    # Checked once, so the debug messages cost nothing at INFO level
+    debug_enabled = logging.getLogger().isEnabledFor(logging.DEBUG)
+    logging.info(f"Processing missing days for {total_stocks} stocks...")
+
+    # Rather than reindexing and concatenating a frame per stock, work out for every expected
+    # (stock, business day) row which input row feeds it (-1 for a missing day) for all stocks at
+    # once, and build the output once from that.
+    # A stable sort by stock then date lines up each stock's rows, earliest input row first among equal dates.
+    row_dates = df.index.as_unit(all_business_days.unit).asi8
+    order = np.lexsort((row_dates, stock_codes))
+    order = order[stock_codes[order] >= 0]
+    sorted_codes = stock_codes[order]
+    sorted_dates = row_dates[order]
+
+    # --- FIX: Remove duplicate index entries before reindexing ---
+    # Keep the first occurrence of duplicate dates
+    duplicated = np.r_[False, (sorted_codes[1:] == sorted_codes[:-1]) & (sorted_dates[1:] == sorted_dates[:-1])]
+    if duplicated.any():
+        duplicate_counts = np.bincount(sorted_codes[duplicated], minlength=total_stocks)
+        for code in np.flatnonzero(duplicate_counts):
+            logging.warning(f"Stock ID {stock_ids[code]}: Found and removed {duplicate_counts[code]} duplicate date entries. Keeping first occurrence.")
+        order = order[~duplicated]
+        sorted_codes = sorted_codes[~duplicated]
+        sorted_dates = sorted_dates[~duplicated]
+    # --- END FIX ---
+
+    # Determine the full date range for each stock based on available data
+    stock_first_rows = np.searchsorted(sorted_codes, np.arange(total_stocks), side='left')
+    stock_last_rows = np.searchsorted(sorted_codes, np.arange(total_stocks), side='right') - 1
+    calendar = all_business_days.asi8
+    start_pos = np.searchsorted(calendar, sorted_dates[stock_first_rows], side='left')
+    end_pos = np.searchsorted(calendar, sorted_dates[stock_last_rows], side='right')
+    block_lengths = end_pos - start_pos
+    block_offsets = np.cumsum(block_lengths) - block_lengths
+
+    # Each stock's expected range of business days, as positions into the shared calendar
+    business_day_positions = np.arange(block_lengths.sum()) + np.repeat(start_pos - block_offsets, block_lengths)
+
+    # Map every expected business day to its input row, missing ones stay -1. Input rows on
+    # weekends or holidays have no place in the calendar and are dropped.
+    calendar_pos = np.searchsorted(calendar, sorted_dates, side='left')
+    on_calendar = calendar_pos < len(calendar)
+    on_calendar[on_calendar] = calendar[calendar_pos[on_calendar]] == sorted_dates[on_calendar]
+    source_rows = np.full(len(business_day_positions), -1, dtype=np.int64)
+    source_rows[(block_offsets[sorted_codes] + calendar_pos - start_pos[sorted_codes])[on_calendar]] = order[on_calendar]
+
+    if not total_stocks:
         logging.warning("No stock data could be processed for missing days. Returning empty DataFrame.")
         # Return an empty DataFrame with the original structure
         empty_filled_df = pd.DataFrame(columns=df.columns).astype(df.dtypes)
@@ -131,9 +214,64 @@ def handle_missing_trading_days(df):
         empty_filled_df.index.name = original_index_name
         return empty_filled_df
 
+    # Clean data is the common case: when every row found its own business day and no expected day was
+    # left without a row, and the values have no gaps either, there is nothing to add, fill or drop
+    if len(source_rows) == len(df) and (source_rows >= 0).all() and not df[cols_to_interpolate].isna().to_numpy().any():
+        logging.info("No missing trading days found, the data is unchanged.")
+        return df if df.index.is_monotonic_increasing else df.sort_index()
 
     logging.info("Combining data after handling missing days...")
-    combined_filled_df = pd.concat(all_stocks_filled)
+    # One positional reindex builds every stock's rows at once, missing days come out as NaN rows
+    combined_filled_df = df.reset_index(drop=True).reindex(source_rows)
+    combined_filled_df.reset_index(drop=True, inplace=True)
+
+    # Work positionally, the combined dates repeat across stocks
+    combined_dates = all_business_days[business_day_positions]
+
+    # Fill in stock_id for the newly added NaN rows
+    combined_filled_df['stock_id'] = np.repeat(np.asarray(stock_ids, dtype=object), block_lengths)
+
+    # Keep stock_id dictionary encoded if it came in that way
+    if isinstance(df['stock_id'].dtype, pd.CategoricalDtype):
+        combined_filled_df['stock_id'] = pd.Categorical(combined_filled_df['stock_id'], categories=df['stock_id'].cat.categories)
+
+    # Identify rows that were originally missing
+    missing_rows_mask = combined_filled_df['open'].isna().to_numpy() # Check one column like 'open'
+
+    if not cols_to_interpolate:
+        logging.warning("No numeric columns found to interpolate. Skipping interpolation.")
+    elif missing_rows_mask.any():
+        if debug_enabled:
+            logging.debug("Interpolating %d missing trading days.", missing_rows_mask.sum())
+        # Every stock is a contiguous block of rows, only stocks with missing trading days are interpolated
+        block_ends = np.cumsum(block_lengths)
+        block_starts = block_ends - block_lengths
+        block_ids = np.repeat(np.arange(len(block_lengths)), block_lengths)
+        stocks_to_fill = (np.bincount(block_ids, weights=missing_rows_mask, minlength=len(block_lengths)) > 0)[block_ids]
+        row_block_starts = block_starts[block_ids]
+        row_block_ends = block_ends[block_ids]
+        # The added rows are NaN in every column, so the neighbour search for the gaps is done once
+        gap_neighbours = find_fill_neighbours(missing_rows_mask, row_block_starts, row_block_ends, stocks_to_fill)
+        for col in cols_to_interpolate:
+            values = combined_filled_df[col].to_numpy()
+            # Integer columns came through without gaps, so there is nothing to fill
+            if values.dtype.kind == 'f':
+                # Only a column with NaNs of its own in the source data needs its own search
+                nan_mask = np.isnan(values)
+                neighbours = gap_neighbours if np.array_equal(nan_mask, missing_rows_mask) else None
+                if neighbours is None:
+                    neighbours = find_fill_neighbours(nan_mask, row_block_starts, row_block_ends, stocks_to_fill)
+                combined_filled_df[col] = interpolate_within_blocks(values, row_block_starts, row_block_ends, stocks_to_fill, neighbours)
+    else:
+        logging.debug("No missing trading days found.")
+
+    combined_filled_df.index = combined_dates
+
+    # Drop any remaining rows that couldn't be filled, skipping the copy when every row is complete
+    unfilled_rows = combined_filled_df[cols_to_interpolate].isna().to_numpy().any(axis=1)
+    if unfilled_rows.any():
+        combined_filled_df = combined_filled_df[~unfilled_rows]
+
     combined_filled_df.sort_index(inplace=True) # Ensure final sort order
     combined_filled_df.index.name = original_index_name # Ensure final index name is preserved
 
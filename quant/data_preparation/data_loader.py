@@ -1,22 +1,39 @@
 """
-Loads historical stock data from multiple CSV files into a single DataFrame.
+Loads historical stock data from multiple CSV (or Parquet) files into a single DataFrame.
 """
 import os
-import pandas as pd
+import pyarrow as pa
 import logging
 from pathlib import Path
-from .data_utils import load_csv_data
+from concurrent.futures import ProcessPoolExecutor
+from .data_utils import load_csv_data, stock_file_suffixes
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-def load_all_stock_data(data_dir):
+def load_stock_file(file_path):
     """
-    Loads all stock CSV files from the specified directory, combines them,
+    Loads a single '{stock_id}.csv' (or '.parquet') file, taking the stock ID from the filename.
+    Module level so it can be sent to worker processes.
+
+    Args:
+        file_path (Path): Path to the CSV or Parquet file.
+
+    Returns:
+        pa.Table: Loaded data as an Arrow table (index kept as a column), or None if error.
+    """
+    df = load_csv_data(file_path, file_path.stem)
+    return pa.Table.from_pandas(df) if df is not None else None
+
+def load_all_stock_data(data_dir, max_workers=None):
+    """
+    Loads all stock CSV and Parquet files from the specified directory, combines them,
     and performs initial preprocessing.
 
     Args:
-        data_dir (str or Path): The directory containing the historical stock CSV files.
-                                Each file should be named '{stock_id}.csv'.
+        data_dir (str or Path): The directory containing the historical stock files.
+                                Each file should be named '{stock_id}.csv' or '{stock_id}.parquet'.
+        max_workers (int, optional): Number of processes used to parse the files.
+                                     Defaults to the number of CPUs.
 
     Returns:
         pd.DataFrame: A single DataFrame containing data for all stocks,
@@ -29,39 +46,50 @@ def load_all_stock_data(data_dir):
         logging.error(f"Data directory not found or is not a directory: {data_dir}")
         return None
 
-    all_dataframes = []
-    csv_files = list(data_path.glob('*.csv'))
+    all_tables = []
+    csv_files = [path for path in data_path.iterdir() if path.suffix.lower() in stock_file_suffixes]
     total_files = len(csv_files)
-    logging.info(f"Found {total_files} CSV files in {data_dir}. Starting load process...")
+    logging.info(f"Found {total_files} stock files in {data_dir}. Starting load process...")
 
     processed_count = 0
     error_count = 0
 
-    for i, file_path in enumerate(csv_files):
-        stock_id = file_path.stem  # Get stock ID from filename without extension
-        logging.debug(f"Processing file {i+1}/{total_files}: {file_path.name}")
+    # Parsing (dates especially) is CPU bound and every file is independent, so spread them over processes
+    workers = max(1, min(max_workers or os.cpu_count() or 1, total_files))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(load_stock_file, csv_files, chunksize=16)
+
+        for i, (file_path, table) in enumerate(zip(csv_files, results)):
+            logging.debug(f"Processed file {i+1}/{total_files}: {file_path.name}")
 
-        df = load_csv_data(file_path, stock_id)
-        if df is not None:
-            all_dataframes.append(df)
-            processed_count += 1
-        else:
-            error_count += 1
-            logging.warning(f"Failed to load or process {file_path.name}")
+            if table is not None:
+                all_tables.append(table)
+                processed_count += 1
+            else:
+                error_count += 1
+                logging.warning(f"Failed to load or process {file_path.name}")
 
-        # Optional: Log progress periodically
-        if (i + 1) % 100 == 0:
-            logging.info(f"Processed {i+1}/{total_files} files...")
+            # Optional: Log progress periodically
+            if (i + 1) % 100 == 0:
+                logging.info(f"Processed {i+1}/{total_files} files...")
 
     logging.info(f"Finished loading files. Successfully loaded: {processed_count}, Errors/Skipped: {error_count}")
 
-    if not all_dataframes:
+    if not all_tables:
         logging.error("No valid stock data loaded. Cannot proceed.")
         return None
 
-    # Combine all dataframes
+    # Combine all tables
     logging.info("Combining all loaded stock data into a single DataFrame...")
-    combined_df = pd.concat(all_dataframes)
+    # Arrow concatenates the per-file tables by reference, so only the conversion to pandas copies the data,
+    # and self_destruct frees each Arrow column as soon as it has been converted
+    combined_table = pa.concat_tables(all_tables, promote_options='permissive')
+    all_tables.clear()
+    combined_df = combined_table.to_pandas(self_destruct=True, split_blocks=True)
+    del combined_table
+
+    # Arrow unifies the per-file dictionaries in load order, keep the stock categories sorted by name
+    combined_df['stock_id'] = combined_df['stock_id'].cat.set_categories(sorted(combined_df['stock_id'].cat.categories))
 
     # Ensure the final DataFrame is sorted by datetime index
     combined_df.sort_index(inplace=True)
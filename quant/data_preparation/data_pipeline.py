@@ -90,9 +90,11 @@ def main():
     # --- 4. Window Creation & Target Generation ---
     # Note: Target calculation is now integrated within create_windows_and_target
     logging.info("Step 4: Creating windows and target variable...")
+    # combined_df isn't used after this step, so the target is added to it directly rather than to a copy
     windowed_df = create_windows_and_target(combined_df,
                                             window_size=args.window_size,
-                                            prediction_days=args.prediction_days)
+                                            prediction_days=args.prediction_days,
+                                            copy=False)
     if windowed_df is None:
         logging.error("Pipeline failed: Could not create windows.")
         return 1
@@ -105,7 +107,10 @@ def main():
     output_file = output_path / args.output_filename
 
     try:
-        windowed_df.to_parquet(output_file, index=False) # Save without index as it's part of the columns now
+        # Save without index as it's part of the columns now. zstd packs the OHLC columns tighter than the
+        # default snappy at similar cost, and bounded row groups let readers scan them in parallel
+        windowed_df.to_parquet(output_file, index=False, engine='pyarrow', compression='zstd', compression_level=3,
+                               row_group_size=128_000, use_dictionary=['stock_id'])
         logging.info(f"Processed data saved successfully to: {output_file}")
     except Exception as e:
         logging.error(f"Failed to save processed data to {output_file}: {e}")
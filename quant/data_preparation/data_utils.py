@@ -1,34 +1,110 @@
 """
 Utility functions for the data preparation pipeline.
 """
+import os
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pv
+import pyarrow.parquet as pq
 import logging
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-def load_csv_data(file_path, stock_id):
+# Prices are read as float32, single precision is plenty for them and halves the bytes every later pass moves
+price_column_types = {col: pa.float32() for col in ['open', 'high', 'low', 'close']}
+
+# Historical files are CSV, or Parquet as written by top_performers.py download
+parquet_suffixes = ('.parquet', '.pq')
+stock_file_suffixes = ('.csv',) + parquet_suffixes
+
+def read_stock_csv(file_path, columns):
     """
-    Loads a single stock CSV file, adds stock_id, parses dates, and sorts.
+    Reads the given columns of a stock CSV file with the Arrow CSV reader,
+    parsing the 'datetime' column natively where it is in ISO format and
+    any OHLC price columns as float32.
 
     Args:
         file_path (str or Path): Path to the CSV file.
+        columns (list): Columns to read. Raises KeyError if any are missing.
+
+    Returns:
+        pd.DataFrame: DataFrame with the requested columns, 'datetime' as datetime64[ns]
+                      and prices as float32.
+    """
+    # The files are small and the loader already reads them in parallel, so keep Arrow single threaded
+    read_options = pv.ReadOptions(use_threads=False)
+    column_types = {col: price_column_types[col] for col in columns if col in price_column_types}
+    try:
+        convert_options = pv.ConvertOptions(include_columns=columns, column_types={**column_types, 'datetime': pa.timestamp('ns')})
+        return pv.read_csv(file_path, read_options=read_options, convert_options=convert_options).to_pandas()
+    except pa.ArrowInvalid:
+        # Dates Arrow can't parse itself are left to pandas
+        convert_options = pv.ConvertOptions(include_columns=columns, column_types={**column_types, 'datetime': pa.string()})
+        df = pv.read_csv(file_path, read_options=read_options, convert_options=convert_options).to_pandas()
+        df['datetime'] = pd.to_datetime(df['datetime'])
+        return df
+
+def read_stock_parquet(file_path, columns):
+    """
+    Reads the given columns of a stock Parquet file, with the same result as read_stock_csv.
+    A 'datetime' index saved by pandas is stored as a column, so it is read like any other.
+
+    Args:
+        file_path (str or Path): Path to the Parquet file.
+        columns (list): Columns to read. Raises KeyError if any are missing.
+
+    Returns:
+        pd.DataFrame: DataFrame with the requested columns, 'datetime' as datetime64[ns]
+                      and prices as float32.
+    """
+    schema = pq.read_schema(file_path)
+    missing_columns = [col for col in columns if col not in schema.names]
+    if missing_columns:
+        raise KeyError(missing_columns)
+    table = pq.read_table(file_path, columns=columns, use_threads=False)
+    column_types = {**{col: price_column_types[col] for col in columns if col in price_column_types}, 'datetime': pa.timestamp('ns')}
+    table = table.cast(pa.schema([field.with_type(column_types.get(field.name, field.type)) for field in table.schema]))
+    return table.to_pandas(ignore_metadata=True)
+
+def load_csv_data(file_path, stock_id):
+    """
+    Loads a single stock CSV (or Parquet) file, adds stock_id, parses dates, and sorts.
+
+    Args:
+        file_path (str or Path): Path to the CSV or Parquet file.
         stock_id (str): The stock identifier (ticker symbol).
 
     Returns:
         pd.DataFrame: Loaded and preprocessed DataFrame, or None if error.
     """
+    required_columns = ['datetime', 'open', 'high', 'low', 'close', 'volume']
     try:
-        df = pd.read_csv(file_path)
-        required_columns = ['datetime', 'open', 'high', 'low', 'close', 'volume']
-        if not all(col in df.columns for col in required_columns):
-            logging.warning(f"Skipping {stock_id}: Missing required columns in {file_path}")
-            return None
+        # The Arrow reader reports an empty file as a generic ArrowInvalid, so catch that case up front
+        if os.path.getsize(file_path) == 0:
+            raise pd.errors.EmptyDataError("No columns to parse from file")
 
-        df['datetime'] = pd.to_datetime(df['datetime'])
-        df.sort_values('datetime', inplace=True)
+        if os.path.splitext(file_path)[1].lower() in parquet_suffixes:
+            df = read_stock_parquet(file_path, required_columns)
+        else:
+            df = read_stock_csv(file_path, required_columns)
+
+        # Files are usually stored newest first, so a reverse is enough in the common case
+        if df['datetime'].is_monotonic_increasing:
+            pass
+        elif df['datetime'].is_monotonic_decreasing and df['datetime'].is_unique:
+            df = df.iloc[::-1].reset_index(drop=True)
+        else:
+            df.sort_values('datetime', inplace=True)
         df.set_index('datetime', inplace=True)
-        df['stock_id'] = stock_id
+        # Volumes are whole share counts, store them in the smallest unsigned int that holds them
+        df['volume'] = pd.to_numeric(df['volume'], downcast='unsigned')
+        # Dictionary encoded, so the id costs a small int code per row rather than a string pointer
+        df['stock_id'] = pd.Categorical([stock_id] * len(df), categories=[stock_id])
         return df
+    except KeyError:
+        # Raised by the Arrow reader when one of the required columns is not in the file
+        logging.warning(f"Skipping {stock_id}: Missing required columns in {file_path}")
+        return None
     except FileNotFoundError:
         logging.error(f"File not found: {file_path}")
         return None
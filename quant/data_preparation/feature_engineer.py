@@ -2,11 +2,67 @@
 Calculates financial features for the stock data.
 """
 import pandas as pd
+import numpy as np
 import logging
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-def calculate_daily_returns(df):
+def sorted_stock_codes(stock_ids):
+    """
+    Numbers the stocks of a DataFrame sorted by stock_id, where every stock is a
+    contiguous block of rows, without building a hash table of the ids.
+
+    Args:
+        stock_ids (pd.Series): The sorted 'stock_id' column.
+
+    Returns:
+        np.ndarray: An integer code for each row, equal for the rows of one stock.
+    """
+    if isinstance(stock_ids.dtype, pd.CategoricalDtype):
+        # The dictionary codes already number the stocks
+        return stock_ids.cat.codes.to_numpy()
+    # Otherwise a new stock starts wherever the id differs from the previous row's
+    ids = stock_ids.to_numpy()
+    return np.cumsum(np.r_[False, ids[1:] != ids[:-1]]) if len(ids) else np.zeros(0, dtype=np.int64)
+
+def stock_block_starts(stock_codes):
+    """
+    For a DataFrame sorted by stock_id, where every stock is a contiguous block of rows,
+    gives each row the position of its block's first row.
+
+    Args:
+        stock_codes (np.ndarray): Integer code of each row's stock_id, from sorted_stock_codes.
+
+    Returns:
+        np.ndarray: The block start position of every row.
+    """
+    block_changes = np.r_[True, stock_codes[1:] != stock_codes[:-1]] if len(stock_codes) else np.zeros(0, dtype=bool)
+    return np.flatnonzero(block_changes)[np.cumsum(block_changes) - 1]
+
+def rolling_means_within_blocks(values, row_block_starts, windows):
+    """
+    Trailing means over the last 'window' rows (or fewer, like min_periods=1) of a 1-D
+    array made of contiguous per-stock blocks, never reaching back past a block's start.
+    The running sum is taken once, after which every window size costs one subtraction per row.
+
+    Args:
+        values (np.ndarray): Numeric column values without NaNs.
+        row_block_starts (np.ndarray): For each row, the position of its block's first row.
+        windows (list): The window sizes.
+
+    Returns:
+        dict: The float64 trailing means for each window size.
+    """
+    running_sum = np.zeros(len(values) + 1)
+    np.cumsum(values, dtype=np.float64, out=running_sum[1:])
+    positions = np.arange(len(values))
+    window_means = {}
+    for window in windows:
+        window_starts = np.maximum(positions - (window - 1), row_block_starts)
+        window_means[window] = (running_sum[positions + 1] - running_sum[window_starts]) / (positions + 1 - window_starts)
+    return window_means
+
+def calculate_daily_returns(df, assume_sorted=False, stock_codes=None):
     """
     Calculates the daily percentage return based on the 'close' price.
     Handles calculations per stock_id.
@@ -15,6 +71,11 @@ def calculate_daily_returns(df):
         df (pd.DataFrame): DataFrame with stock data, must include 'close'
                            and 'stock_id' columns. The DataFrame will be sorted
                            internally by stock_id, datetime.
+        assume_sorted (bool): Skip the sort when the caller has already sorted
+                              the DataFrame by stock_id, datetime.
+        stock_codes (np.ndarray, optional): Integer code of each row's stock_id in the
+                                            sorted DataFrame, from sorted_stock_codes. Lets the
+                                            caller number the stocks once for several features.
 
     Returns:
         pd.DataFrame: DataFrame with an added 'daily_return' column.
@@ -29,13 +90,42 @@ def calculate_daily_returns(df):
     # Ensure data is sorted by stock_id and then datetime for correct pct_change
     # Perform calculation on a sorted copy to avoid modifying original order if not desired
     # Or, modify the input df directly if sorted output is acceptable. Let's modify directly.
-    df.sort_values(['stock_id', df.index.name], inplace=True)
-    df['daily_return'] = df.groupby('stock_id', group_keys=False)['close'].pct_change() # group_keys=False is slightly cleaner
+    if not assume_sorted:
+        df.sort_values(['stock_id', df.index.name], inplace=True)
+    close = df['close'].to_numpy()
+    if close.dtype.kind in 'iuf':
+        # Each stock is now a contiguous block, so one shifted division over the whole column does every
+        # stock at once, with the first row of each stock left NaN like the grouped pct_change
+        close = close if close.dtype.kind == 'f' else close.astype(np.float64)
+        if stock_codes is None:
+            stock_codes = sorted_stock_codes(df['stock_id'])
+        block_starts = np.flatnonzero(np.r_[True, stock_codes[1:] != stock_codes[:-1]]) if len(close) else np.zeros(0, dtype=np.int64)
+        nan_close = np.isnan(close)
+        if nan_close.any():
+            # pct_change forward fills gaps within each stock, so carry the last valid close forward,
+            # but never from the previous stock's block
+            positions = np.arange(len(close))
+            last_valid = np.maximum.accumulate(np.where(nan_close, -1, positions))
+            row_block_starts = np.repeat(block_starts, np.diff(np.r_[block_starts, len(close)]))
+            close = np.where(last_valid >= row_block_starts, close[np.maximum(last_valid, 0)], np.nan).astype(close.dtype)
+        previous_close = np.empty_like(close)
+        previous_close[1:] = close[:-1]
+        previous_close[:1] = np.nan
+        # A zero close gives inf, as pct_change does, without numpy's warning
+        with np.errstate(divide='ignore', invalid='ignore'):
+            daily_return = close / previous_close - 1
+        daily_return[block_starts] = np.nan
+        df['daily_return'] = daily_return
+    else:
+        if stock_codes is None:
+            stock_codes = sorted_stock_codes(df['stock_id'])
+        # Grouping on the integer codes skips hashing the stock_id strings
+        df['daily_return'] = df['close'].groupby(stock_codes, sort=False, group_keys=False).pct_change() # group_keys=False is slightly cleaner
 
     logging.info("Daily returns calculated.")
     return df
 
-def calculate_moving_averages(df, windows=[5, 20]):
+def calculate_moving_averages(df, windows=[5, 20], assume_sorted=False, stock_codes=None):
     """
     Calculates moving averages for the 'close' price for specified window sizes.
     Handles calculations per stock_id.
@@ -46,6 +136,11 @@ def calculate_moving_averages(df, windows=[5, 20]):
                            internally by stock_id, datetime.
         windows (list): A list of integers representing the window sizes
                         for the moving averages (e.g., [5, 20]).
+        assume_sorted (bool): Skip the sort when the caller has already sorted
+                              the DataFrame by stock_id, datetime.
+        stock_codes (np.ndarray, optional): Integer code of each row's stock_id in the
+                                            sorted DataFrame, from sorted_stock_codes. Lets the
+                                            caller number the stocks once for several features.
 
     Returns:
         pd.DataFrame: DataFrame with added moving average columns (e.g., 'MA_5', 'MA_20').
@@ -58,20 +153,33 @@ def calculate_moving_averages(df, windows=[5, 20]):
 
     logging.info(f"Calculating moving averages for windows: {windows}...")
     # Ensure data is sorted by stock_id and then datetime for correct rolling calculation
-    df.sort_values(['stock_id', df.index.name], inplace=True)
+    if not assume_sorted:
+        df.sort_values(['stock_id', df.index.name], inplace=True)
 
-    for window in windows:
-        ma_col_name = f'MA_{window}'
-        logging.debug(f"Calculating {ma_col_name}...")
-        # Use transform with rolling mean. Transform ensures the result aligns with the original index.
-        df[ma_col_name] = df.groupby('stock_id', group_keys=False)['close'].transform(
-            lambda x: x.rolling(window=window, min_periods=1).mean()
-        )
+    # Grouping on integer codes rather than stock_id skips hashing the ids, which are often strings
+    if stock_codes is None:
+        stock_codes = sorted_stock_codes(df['stock_id'])
+    close = df['close'].to_numpy()
+
+    if close.dtype.kind in 'iuf' and not np.isnan(close).any():
+        # Each stock is a contiguous block, so the means for every window come from one running sum
+        # over the whole column (a gap would need the rolling count of valid values, see below)
+        window_means = rolling_means_within_blocks(close, stock_block_starts(stock_codes), windows)
+        for window in windows:
+            df[f'MA_{window}'] = window_means[window]
+    else:
+        grouped_close = df['close'].groupby(stock_codes, sort=False)
+        for window in windows:
+            ma_col_name = f'MA_{window}'
+            logging.debug(f"Calculating {ma_col_name}...")
+            # Grouped rolling runs every stock through one Cython loop. With sort=False it returns the groups
+            # in order of appearance, which is the row order of the sorted frame, so assign positionally.
+            df[ma_col_name] = grouped_close.rolling(window=window, min_periods=1).mean().to_numpy()
 
     logging.info("Moving averages calculated.")
     return df
 
-def calculate_volume_indicators(df, window=7):
+def calculate_volume_indicators(df, window=7, assume_sorted=False, stock_codes=None):
     """
     Calculates volume-based indicators, specifically the average volume over a past window.
     Handles calculations per stock_id.
@@ -81,6 +189,11 @@ def calculate_volume_indicators(df, window=7):
                            and 'stock_id' columns. The DataFrame will be sorted
                            internally by stock_id, datetime.
         window (int): The window size (in days) for calculating the average volume.
+        assume_sorted (bool): Skip the sort when the caller has already sorted
+                              the DataFrame by stock_id, datetime.
+        stock_codes (np.ndarray, optional): Integer code of each row's stock_id in the
+                                            sorted DataFrame, from sorted_stock_codes. Lets the
+                                            caller number the stocks once for several features.
 
     Returns:
         pd.DataFrame: DataFrame with an added 'avg_volume_{window}' column.
@@ -94,12 +207,20 @@ def calculate_volume_indicators(df, window=7):
     vol_col_name = f'avg_volume_{window}'
     logging.info(f"Calculating average volume indicator ({vol_col_name})...")
     # Ensure data is sorted by stock_id and then datetime for correct rolling calculation
-    df.sort_values(['stock_id', df.index.name], inplace=True)
+    if not assume_sorted:
+        df.sort_values(['stock_id', df.index.name], inplace=True)
 
-    # Use transform with rolling mean for volume
-    df[vol_col_name] = df.groupby('stock_id', group_keys=False)['volume'].transform(
-        lambda x: x.rolling(window=window, min_periods=1).mean()
-    )
+    if stock_codes is None:
+        stock_codes = sorted_stock_codes(df['stock_id'])
+    volume = df['volume'].to_numpy()
+    if volume.dtype.kind in 'iuf' and not np.isnan(volume).any():
+        # Running sum over the sorted volume column, the same way as the moving averages
+        df[vol_col_name] = rolling_means_within_blocks(volume, stock_block_starts(stock_codes), [window])[window]
+    else:
+        # Grouped rolling mean for volume, in the sorted frame's row order (see calculate_moving_averages)
+        df[vol_col_name] = df['volume'].groupby(stock_codes, sort=False).rolling(
+            window=window, min_periods=1
+        ).mean().to_numpy()
 
     logging.info("Volume indicators calculated.")
     return df
@@ -120,11 +241,20 @@ def engineer_features(df):
     # Sort by stock_id and datetime index - crucial for correct group-wise calculations
     df.sort_values(['stock_id', df.index.name], inplace=True)
 
-    df = calculate_daily_returns(df)
-    df = calculate_moving_averages(df, windows=[5, 20]) # As per spec
-    df = calculate_volume_indicators(df, window=7) # As per spec (past week)
+    # Sorted and numbered once here, so the steps below skip their own sorts and share the stock codes
+    stock_codes = sorted_stock_codes(df['stock_id'])
+    df = calculate_daily_returns(df, assume_sorted=True, stock_codes=stock_codes)
+    df = calculate_moving_averages(df, windows=[5, 20], assume_sorted=True, stock_codes=stock_codes) # As per spec
+    df = calculate_volume_indicators(df, window=7, assume_sorted=True, stock_codes=stock_codes) # As per spec (past week)
+
+    # The rolling kernels hand back float64, but the features don't need double precision,
+    # so store the columns added here as float32 like the OHLC prices (input columns are left as they came)
+    feature_cols = [col for col in ['daily_return', 'MA_5', 'MA_20', 'avg_volume_7']
+                    if col in df.columns and df[col].dtype == np.float64]
+    if feature_cols:
+        df[feature_cols] = df[feature_cols].astype(np.float32)
 
-    # The DataFrame is already sorted by stock_id, datetime from the functions above.
+    # The DataFrame is still sorted by stock_id, datetime from the sort above.
     logging.info("Feature engineering process completed.")
     return df
 
@@ -3,24 +3,27 @@
 stock_data.py - Retrieves daily OHLCV data for a stock over the past 12 months.
 
 Usage:
-    python quant/stock_data.py SYMBOL [--output OUTPUT_FILE]
+    python quant/stock_data.py SYMBOL [SYMBOL ...] [--output OUTPUT_FILE]
 
 Example:
-    python quant/stock_data.py MSFT --output quant/msft_data.csv
+    python quant/stock_data.py MSFT --output quant/msft_data.parquet
+    python quant/stock_data.py MSFT AAPL NVDA
 """
 
 import os
 import argparse
 import datetime
+import hashlib
 import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
 from twelvedata import TDClient
 from dotenv import load_dotenv
 
 def parse_arguments():
     """Parse command-line arguments."""
     parser = argparse.ArgumentParser(description='Pull daily stock data for the last 12 months.')
-    parser.add_argument('symbol', type=str, help='Stock symbol to retrieve data for (e.g., MSFT)')
-    parser.add_argument('--output', type=str, help='Output CSV filename (default: quant/<symbol>_daily_data.csv)')
+    parser.add_argument('symbols', type=str, nargs='+', help='Stock symbol(s) to retrieve data for (e.g., MSFT AAPL)')
+    parser.add_argument('--output', type=str, help='Output filename, .parquet/.pq or .csv, single symbol only (default: quant/<symbol>_daily_data.parquet)')
     return parser.parse_args()
 
 def get_date_range():
@@ -29,8 +32,20 @@ def get_date_range():
     start_date = end_date - datetime.timedelta(days=365)  # Approximately 12 months
     return start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d')
 
-def fetch_stock_data(api_key, symbol, start_date, end_date):
-    """Fetch daily stock data from Twelve Data API."""
+# Responses already fetched are kept here, so repeating a run doesn't go back to the API
+default_cache_dir = os.path.join(os.path.expanduser('~'), '.cache', 'nanoGPT_quant')
+
+def get_cache_path(symbol, start_date, end_date, interval="1day", cache_dir=default_cache_dir):
+    """Cache file for one query, keyed on everything that changes the response."""
+    key = hashlib.sha1(f"{symbol}|{start_date}|{end_date}|{interval}".encode()).hexdigest()
+    return os.path.join(cache_dir, f"{key}.parquet")
+
+def fetch_stock_data(api_key, symbol, start_date, end_date, cache_dir=default_cache_dir):
+    """Fetch daily stock data from Twelve Data API, or from the local cache if this query was fetched before."""
+    cache_path = get_cache_path(symbol, start_date, end_date, cache_dir=cache_dir) if cache_dir else None
+    if cache_path and os.path.exists(cache_path):
+        return pd.read_parquet(cache_path)
+
     # Initialize client
     td = TDClient(apikey=api_key)
 
@@ -44,27 +59,55 @@ def fetch_stock_data(api_key, symbol, start_date, end_date):
     )
 
     # Return data as pandas DataFrame
-    return ts.as_pandas()
-
-def save_to_csv(dataframe, filename):
-    """Save the stock data to a CSV file."""
+    data = ts.as_pandas()
+
+    # Only keep real results, so an empty response is asked for again next time
+    if cache_path and data is not None and not data.empty:
+        os.makedirs(cache_dir, exist_ok=True)
+        data.to_parquet(cache_path, compression='zstd')
+
+    return data
+
+def fetch_stock_data_many(api_key, symbols, start_date, end_date, max_workers=8):
+    """
+    Fetch daily stock data for several symbols at once.
+    The requests are network bound, so they overlap on threads instead of running one after another.
+
+    Returns:
+        dict: symbol -> DataFrame, or the exception raised while fetching that symbol.
+    """
+    def fetch(symbol):
+        try:
+            return fetch_stock_data(api_key, symbol, start_date, end_date)
+        except Exception as e:
+            return e
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(symbols)))) as executor:
+        return dict(zip(symbols, executor.map(fetch, symbols)))
+
+def save_dataframe(dataframe, filename):
+    """Save the stock data to a Parquet file, or a CSV file for any other extension."""
     # Ensure the directory exists if the filename includes a path
     output_dir = os.path.dirname(filename)
     if output_dir and not os.path.exists(output_dir):
         os.makedirs(output_dir)
-        
-    dataframe.to_csv(filename)
+
+    # Parquet keeps the column types and the datetime index, so loading it back needs no parsing
+    if os.path.splitext(filename)[1].lower() in ('.parquet', '.pq'):
+        dataframe.to_parquet(filename, compression='zstd', engine='pyarrow')
+    else:
+        dataframe.to_csv(filename)
     print(f"Data saved to {filename}")
 
 def main():
     """Main function to orchestrate the stock data retrieval."""
     # Parse arguments
     args = parse_arguments()
-    symbol = args.symbol.upper()
-    
-    # Default output path within the quant directory
-    default_output_file = os.path.join('quant', f"{symbol}_daily_data.csv")
-    output_file = args.output if args.output else default_output_file
+    symbols = list(dict.fromkeys(symbol.upper() for symbol in args.symbols))
+
+    if args.output and len(symbols) > 1:
+        print("ERROR: --output can only be used with a single symbol")
+        return 1
 
     # Load API key from .env in the script's directory
     script_dir = os.path.dirname(os.path.abspath(__file__))
@@ -79,20 +122,32 @@ def main():
     try:
         # Get date range
         start_date, end_date = get_date_range()
-        print(f"Fetching daily data for {symbol} from {start_date} to {end_date}")
+        print(f"Fetching daily data for {', '.join(symbols)} from {start_date} to {end_date}")
 
         # Fetch data
-        data = fetch_stock_data(api_key, symbol, start_date, end_date)
+        results = fetch_stock_data_many(api_key, symbols, start_date, end_date)
+
+        exit_code = 0
+        for symbol, data in results.items():
+            if isinstance(data, Exception):
+                print(f"ERROR: An error occurred fetching {symbol}: {data}")
+                exit_code = 1
+                continue
+
+            # Check if data is empty
+            if data is None or data.empty:
+                print(f"No data found for symbol {symbol} in the specified date range.")
+                exit_code = 1
+                continue
 
-        # Check if data is empty
-        if data is None or data.empty:
-            print(f"No data found for symbol {symbol} in the specified date range.")
-            return 1
+            # Default output path within the quant directory
+            default_output_file = os.path.join('quant', f"{symbol}_daily_data.parquet")
+            output_file = args.output if args.output else default_output_file
 
-        # Save to CSV
-        save_to_csv(data, output_file)
+            # Save to Parquet (or CSV)
+            save_dataframe(data, output_file)
 
-        return 0
+        return exit_code
 
     except Exception as e:
         print(f"ERROR: An error occurred: {e}")
@@ -10,7 +10,7 @@ Usage:
   python quant/top_performers.py calculate [--hist-dir HIST_DIR] [--limit LIMIT] [--output OUTPUT_FILE]
 
 Examples:
-  # Download data for NYSE & NASDAQ stocks to quant/data/historical/
+  # Download data for NYSE & NASDAQ stocks to quant/data/historical/ (one {symbol}.parquet per stock)
   python quant/top_performers.py download --hist-dir quant/data/historical --use-cache
 
   # Calculate top 500 performers from quant/data/historical/ and save to quant/data/top500_performers.csv
@@ -21,9 +21,21 @@ import os
 import time
 import argparse
 import datetime
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pv
+import pyarrow.parquet as pq
 import logging
+import queue
+import contextlib
 import sys
+import threading
+from collections import namedtuple
+from logging.handlers import QueueHandler, QueueListener
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from twelvedata import TDClient
 from twelvedata.exceptions import TwelveDataError
 from dotenv import load_dotenv
@@ -38,9 +50,11 @@ API_CALLS_PER_MINUTE = 377 # Updated limit
 SECONDS_PER_MINUTE = 60
 # Add a small buffer to the delay to be safe
 # DELAY_BETWEEN_CALLS = (SECONDS_PER_MINUTE / API_CALLS_PER_MINUTE) + 0.5 # No longer needed with high rate limit
+DOWNLOAD_WORKERS = 16 # Concurrent history requests, the rate limit still applies across all of them
+PROGRESS_INTERVAL = 100 # With --progress, log one line per this many completed downloads
 DEFAULT_HIST_DIR = 'quant/data/historical'
 DEFAULT_OUTPUT_FILE = 'quant/data/top_performers.csv'
-STOCK_LIST_CACHE_FILE = 'quant/data/stock_list_cache.json'
+STOCK_LIST_CACHE_FILE = 'quant/data/stock_list_cache.parquet'
 
 def parse_arguments():
     """Parse command-line arguments with subcommands."""
@@ -50,16 +64,18 @@ def parse_arguments():
     # --- Download Mode Arguments ---
     parser_download = subparsers.add_parser('download', help='Download 12-month historical data for stocks.')
     parser_download.add_argument('--hist-dir', type=str, default=DEFAULT_HIST_DIR,
-                                 help=f'Directory to save historical CSV files (default: {DEFAULT_HIST_DIR})')
+                                 help=f'Directory to save historical Parquet files (default: {DEFAULT_HIST_DIR})')
     parser_download.add_argument('--exchanges', nargs='+', default=['NYSE', 'NASDAQ'],
                                  help='List of exchanges to query (default: NYSE NASDAQ)')
     parser_download.add_argument('--use-cache', action='store_true',
                                  help=f'Use cached stock list ({STOCK_LIST_CACHE_FILE}) if available')
+    parser_download.add_argument('--progress', action='store_true',
+                                 help=f'Log progress every {PROGRESS_INTERVAL} downloaded stocks')
 
     # --- Calculate Mode Arguments ---
     parser_calculate = subparsers.add_parser('calculate', help='Calculate top performers from downloaded data.')
     parser_calculate.add_argument('--hist-dir', type=str, default=DEFAULT_HIST_DIR,
-                                  help=f'Directory containing historical CSV files (default: {DEFAULT_HIST_DIR})')
+                                  help=f'Directory containing historical Parquet/CSV files (default: {DEFAULT_HIST_DIR})')
     parser_calculate.add_argument('--limit', type=int, default=500,
                                   help='Number of top performers to retrieve (default: 500)')
     parser_calculate.add_argument('--output', type=str, default=DEFAULT_OUTPUT_FILE,
@@ -95,6 +111,59 @@ def load_api_key():
     logging.info(f"Loaded API key from {dotenv_path}")
     return api_key
 
+def create_td_client(api_key, pool_size=DOWNLOAD_WORKERS):
+    """Creates a Twelve Data client whose connections are kept alive and shared by the download threads."""
+    td_client = TDClient(apikey=api_key)
+    # The client already sends every call through one requests session. Size its connection pool for the
+    # download threads so none of them has to open a new TLS connection per call, and retry transient
+    # server errors and HTTP 429s with backoff (a 429's Retry-After header is honoured).
+    retries = Retry(total=5, backoff_factor=0.5, status_forcelist=[429, 502, 503, 504])
+    td_client.ctx.http_client.session.mount('https://', HTTPAdapter(pool_maxsize=pool_size, max_retries=retries))
+    return td_client
+
+class RateLimiter:
+    """
+    Token bucket for the API calls, shared between threads.
+    Up to `burst` calls can go at once, after that calls are spaced out evenly so that
+    no `period` second window ever holds more than `calls` of them.
+    """
+
+    def __init__(self, calls=API_CALLS_PER_MINUTE, period=SECONDS_PER_MINUTE, burst=10):
+        self.capacity = burst
+        self.rate = (calls - burst) / period # Tokens added per second
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        """Blocks until a token is available, then takes it."""
+        # Holding the lock while sleeping also queues every other thread behind this call
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens < 1:
+                sleep_time = (1 - self.tokens) / self.rate
+                logging.debug(f"Rate limit reached. Sleeping for {sleep_time:.2f} seconds.")
+                time.sleep(sleep_time)
+                self.tokens = 1.0
+                self.updated = time.monotonic()
+            self.tokens -= 1
+
+def clean_stock_list(stock_df):
+    """Drops stocks without a symbol/exchange and repeated symbols, and adds each stock's filename-safe symbol.
+    Returns the stocks as the list of dicts download_historical_data expects."""
+    id_columns = stock_df[['symbol', 'exchange']]
+    valid = (id_columns.notna() & id_columns.ne('')).all(axis=1)
+    if not valid.all():
+        logging.warning(f"Skipping {(~valid).sum()} stocks due to missing symbol/exchange.")
+    stock_df = stock_df[valid].copy()
+    # Sanitize symbol for filename if necessary (though usually not needed for tickers): keep letters, digits, '-' and '.'
+    stock_df['safe_symbol'] = stock_df['symbol'].astype(str).str.replace(r'[^\w.-]|_', '', regex=True)
+    # A symbol listed twice would be saved to the same file, so it is only downloaded once
+    stock_df = stock_df.drop_duplicates('safe_symbol')
+    # Fields missing for some stocks come back as None rather than NaN
+    return stock_df.astype(object).where(stock_df.notna(), None).to_dict('records')
 
 def get_stock_list(td_client, exchanges, use_cache=False):
     """Get list of all stocks from specified exchanges, using cache if requested."""
@@ -102,12 +171,11 @@ def get_stock_list(td_client, exchanges, use_cache=False):
     if use_cache and cache_path.exists():
         logging.info(f"Loading stock list from cache: {cache_path}")
         try:
-            stock_df = pd.read_json(cache_path)
-            if 'symbol' in stock_df.columns and 'exchange' in stock_df.columns:
-                # Filter by requested exchanges from the cached list
-                filtered_stocks = stock_df[stock_df['exchange'].isin(exchanges)]
+            # Filter by requested exchanges from the cached list as it is read, other exchanges' rows are never loaded
+            filtered_stocks = pd.read_parquet(cache_path, filters=[('exchange', 'in', list(exchanges))])
+            if 'symbol' in filtered_stocks.columns and 'exchange' in filtered_stocks.columns:
                 logging.info(f"Loaded {len(filtered_stocks)} stocks for {exchanges} from cache.")
-                return filtered_stocks.to_dict('records')
+                return clean_stock_list(filtered_stocks)
             else:
                 logging.warning("Cache file format unexpected. Fetching fresh list.")
         except Exception as e:
@@ -115,23 +183,15 @@ def get_stock_list(td_client, exchanges, use_cache=False):
 
     logging.info(f"Fetching stock list for exchanges: {exchanges}")
     all_stocks_data = []
-    api_call_count = 0
-    minute_start_time = time.time()
+    rate_limiter = RateLimiter()
 
     for exchange in exchanges:
         try:
-            # --- Rate Limiting Check ---
-            current_time = time.time()
-            if api_call_count >= API_CALLS_PER_MINUTE and (current_time - minute_start_time) < SECONDS_PER_MINUTE:
-                sleep_time = SECONDS_PER_MINUTE - (current_time - minute_start_time) + 1 # Buffer
-                logging.info(f"Rate limit reached fetching stock list. Sleeping for {sleep_time:.2f} seconds.")
-                time.sleep(sleep_time)
-                minute_start_time = time.time() # Reset timer
-                api_call_count = 0 # Reset count
+            # --- Rate Limiting ---
+            rate_limiter.wait()
 
             logging.info(f"Fetching stocks for {exchange}...")
             stocks = td_client.get_stocks_list(exchange=exchange)
-            api_call_count += 1
             stock_data = stocks.as_json()
 
             if isinstance(stock_data, list):
@@ -142,35 +202,65 @@ def get_stock_list(td_client, exchanges, use_cache=False):
             else:
                 logging.warning(f"Received unexpected data type for {exchange}: {type(stock_data)}")
 
-            # Small delay between exchange list calls
-            time.sleep(0.2) # Reduced delay with higher rate limit
-
         except TwelveDataError as e:
             logging.error(f"API error fetching stocks for {exchange}: {e}")
         except Exception as e:
             logging.error(f"Unexpected error fetching stocks for {exchange}: {e}")
 
-    # Save to cache if fetched successfully
-    if all_stocks_data:
-        try:
-            stock_df = pd.DataFrame(all_stocks_data)
-            cache_path.parent.mkdir(parents=True, exist_ok=True) # Ensure dir exists
-            stock_df.to_json(cache_path, orient='records', indent=4)
-            logging.info(f"Saved stock list to cache: {cache_path}")
-        except Exception as e:
-            logging.error(f"Failed to save stock list to cache: {e}")
-
-    return all_stocks_data
+    if not all_stocks_data:
+        return []
 
-def download_historical_data(td_client, stock_list, hist_dir):
-    """Downloads 12-month historical data for each stock in the list."""
+    # Save to cache if fetched successfully
+    stock_df = pd.DataFrame(all_stocks_data)
+    try:
+        cache_path.parent.mkdir(parents=True, exist_ok=True) # Ensure dir exists
+        stock_df.to_parquet(cache_path, compression='zstd')
+        logging.info(f"Saved stock list to cache: {cache_path}")
+    except Exception as e:
+        logging.error(f"Failed to save stock list to cache: {e}")
+
+    return clean_stock_list(stock_df)
+
+def fetch_historical_data(td_client, rate_limiter, symbol, exchange, country, start_date_str, end_date_str):
+    """Fetches the daily history for one stock once the rate limiter allows it. Runs on a worker thread."""
+    rate_limiter.wait()
+    ts = td_client.time_series(
+        symbol=symbol,
+        exchange=exchange,
+        country=country,
+        interval="1day",
+        start_date=start_date_str,
+        end_date=end_date_str,
+        outputsize=5000 # Ensure we get all data points for the year
+    )
+    return ts.as_pandas()
+
+@contextlib.contextmanager
+def queue_logging():
+    """Routes the root logger through a queue while the block runs. The download threads then only enqueue
+    records, and a listener thread formats and writes them with the handlers basicConfig set up.
+    Only for the threaded download: processes forked inside the block would inherit a queue nobody drains."""
+    root = logging.getLogger()
+    handlers = root.handlers[:]
+    log_queue = queue.Queue(-1)
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    root.handlers = [QueueHandler(log_queue)]
+    listener.start()
+    try:
+        yield
+    finally:
+        listener.stop() # Writes out the records still queued
+        root.handlers = handlers
+
+def download_historical_data(td_client, stock_list, hist_dir, max_workers=DOWNLOAD_WORKERS, progress=False):
+    """Downloads 12-month historical data for each stock in the list (as returned by get_stock_list).
+    With progress set, logs one line every PROGRESS_INTERVAL stocks (per-stock lines are DEBUG)."""
     hist_path = Path(hist_dir)
     hist_path.mkdir(parents=True, exist_ok=True) # Ensure directory exists
     logging.info(f"Starting download of historical data to {hist_path}...")
 
     total_stocks = len(stock_list)
-    api_call_count = 0
-    minute_start_time = time.time()
+    rate_limiter = RateLimiter()
     downloaded_count = 0
     skipped_count = 0
     error_count = 0
@@ -180,82 +270,62 @@ def download_historical_data(td_client, stock_list, hist_dir):
     end_date_str = end_date.strftime('%Y-%m-%d')
     start_date_str = start_date.strftime('%Y-%m-%d')
 
-    for i, stock in enumerate(stock_list):
-        symbol = stock.get('symbol')
-        exchange = stock.get('exchange')
-        country = stock.get('country') # Optional
-
-        if not symbol or not exchange:
-            logging.warning(f"Skipping stock {i+1}/{total_stocks} due to missing symbol/exchange: {stock}")
-            skipped_count += 1
-            continue
-
-        # Sanitize symbol for filename if necessary (though usually not needed for tickers)
-        safe_symbol = "".join(c for c in symbol if c.isalnum() or c in ('-', '.'))
-        output_csv = hist_path / f"{safe_symbol}.csv"
-
-        # --- Check if file already exists (Resume capability) ---
-        if output_csv.exists():
-            logging.debug(f"Skipping {symbol} ({i+1}/{total_stocks}): Already downloaded ({output_csv})")
-            skipped_count += 1
-            continue
-
-        # --- Rate Limiting ---
-        current_time = time.time()
-        if api_call_count >= API_CALLS_PER_MINUTE:
-             elapsed_time = current_time - minute_start_time
-             if elapsed_time < SECONDS_PER_MINUTE:
-                  sleep_time = SECONDS_PER_MINUTE - elapsed_time + 0.1 # Small buffer
-                  logging.info(f"Rate limit reached ({api_call_count} calls). Sleeping for {sleep_time:.2f} seconds before processing {symbol}.")
-                  time.sleep(sleep_time)
-             # Reset timer and count for the new minute window
-             minute_start_time = time.time()
-             api_call_count = 0
-
-        # --- Fetch Data ---
-        logging.info(f"Processing {i+1}/{total_stocks}: Downloading {symbol} ({exchange})...")
-        try:
-            ts = td_client.time_series(
-                symbol=symbol,
-                exchange=exchange,
-                country=country,
-                interval="1day",
-                start_date=start_date_str,
-                end_date=end_date_str,
-                outputsize=5000 # Ensure we get all data points for the year
-            )
-            api_call_count += 1
-            data = ts.as_pandas()
-
-            if data is not None and not data.empty:
-                data.to_csv(output_csv)
-                logging.debug(f"Successfully downloaded and saved data for {symbol} to {output_csv}")
-                downloaded_count += 1
-            else:
-                logging.warning(f"No data returned for {symbol}. Skipping save.")
-                # Optionally create an empty file or log separately
-                skipped_count += 1
-
-        except TwelveDataError as e:
-            error_count += 1
-            # Handle common API errors gracefully
-            if "rate limit" in str(e).lower():
-                 # This might still happen if the burst limit is hit, or daily limit
-                 logging.error(f"Rate limit error during download for {symbol}: {e}. Check daily limits if applicable. Stopping.")
-                 sys.exit(1) # Exit immediately if rate limit error occurs unexpectedly
-            elif "not found" in str(e).lower() or "invalid symbol" in str(e).lower():
-                 logging.warning(f"Symbol {symbol} not found or invalid: {e}")
-                 # Optionally create an empty file or log separately
-            else:
-                 logging.error(f"API error downloading {symbol}: {e}")
-        except Exception as e:
-            error_count += 1
-            logging.error(f"Unexpected error downloading {symbol}: {e}")
-
-        # --- Delay between calls ---
-        # With a high rate limit, a fixed delay is less critical,
-        # but a very small one can still be polite to the API.
-        # time.sleep(0.05) # Optional tiny delay
+    # --- Resume capability ---
+    # List the files already downloaded (including CSVs from earlier downloads) once, and work out
+    # up front which stocks still need fetching, so resuming a mostly finished run starts straight away
+    downloaded_symbols = {os.path.splitext(entry.name)[0] for entry in os.scandir(hist_path)
+                          if entry.name.endswith(('.parquet', '.csv'))}
+    # get_stock_list has already dropped invalid and repeated stocks and worked out the file names
+    pending_stocks = [(stock['symbol'], stock['exchange'], stock.get('country'), hist_path / f"{stock['safe_symbol']}.parquet")
+                      for stock in stock_list if stock['safe_symbol'] not in downloaded_symbols]
+    skipped_count = total_stocks - len(pending_stocks)
+
+    logging.info(f"{len(pending_stocks)} stocks to download, {skipped_count} skipped (already downloaded).")
+
+    # The requests spend nearly all their time waiting on the network, so keep several in flight on threads.
+    # Results are saved here on the calling thread as they complete.
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {}
+        for symbol, exchange, country, output_file in pending_stocks:
+            future = executor.submit(fetch_historical_data, td_client, rate_limiter, symbol, exchange, country,
+                                     start_date_str, end_date_str)
+            futures[future] = (symbol, exchange, output_file)
+
+        # --- Save Data ---
+        for completed_count, future in enumerate(as_completed(futures), start=1):
+            symbol, exchange, output_file = futures[future]
+            logging.debug(f"Processing {completed_count}/{len(futures)}: Downloaded {symbol} ({exchange})")
+            if progress and completed_count % PROGRESS_INTERVAL == 0:
+                logging.info(f"Progress: {completed_count}/{len(futures)} stocks processed")
+            try:
+                data = future.result()
+
+                if data is not None and not data.empty:
+                    # Parquet keeps the types and the datetime index, so reading it back needs no parsing
+                    data.to_parquet(output_file, compression='zstd', engine='pyarrow')
+                    logging.debug(f"Successfully downloaded and saved data for {symbol} to {output_file}")
+                    downloaded_count += 1
+                else:
+                    logging.warning(f"No data returned for {symbol}. Skipping save.")
+                    # Optionally create an empty file or log separately
+                    skipped_count += 1
+
+            except TwelveDataError as e:
+                error_count += 1
+                # Handle common API errors gracefully
+                if "rate limit" in str(e).lower():
+                     # This might still happen if the burst limit is hit, or daily limit
+                     logging.error(f"Rate limit error during download for {symbol}: {e}. Check daily limits if applicable. Stopping.")
+                     executor.shutdown(wait=False, cancel_futures=True) # Drop the requests still queued
+                     sys.exit(1) # Exit immediately if rate limit error occurs unexpectedly
+                elif "not found" in str(e).lower() or "invalid symbol" in str(e).lower():
+                     logging.warning(f"Symbol {symbol} not found or invalid: {e}")
+                     # Optionally create an empty file or log separately
+                else:
+                     logging.error(f"API error downloading {symbol}: {e}")
+            except Exception as e:
+                error_count += 1
+                logging.error(f"Unexpected error downloading {symbol}: {e}")
 
     logging.info(f"Download process finished.")
     logging.info(f"Total Stocks: {total_stocks}")
@@ -264,87 +334,177 @@ def download_historical_data(td_client, stock_list, hist_dir):
     logging.info(f"Errors: {error_count}")
 
 
-def calculate_performance(hist_dir, limit, output_file):
-    """Calculates performance from downloaded CSVs and saves top performers."""
+# One file's entry in the calculate summary, see calculate_performance
+SummaryRow = namedtuple('SummaryRow', ['file', 'mtime_ns', 'start_price', 'end_price', 'skipped'])
+
+def read_price_history(hist_file):
+    """
+    Reads the datetime and close columns of one historical file through Arrow, without building a DataFrame.
+
+    Args:
+        hist_file (Path): Path to the '{symbol}.parquet' or '{symbol}.csv' file.
+
+    Returns:
+        tuple: (dates, close) as numpy arrays, in file order. Raises KeyError if either column is missing.
+    """
+    columns = ['datetime', 'close']
+    if hist_file.suffix == '.parquet':
+        # The datetime index pandas saved is stored as an ordinary column
+        if not set(columns).issubset(pq.read_schema(hist_file).names):
+            raise KeyError(columns)
+        table = pq.read_table(hist_file, columns=columns, use_threads=False)
+    else:
+        # The Arrow reader reports an empty file as a generic ArrowInvalid, so catch that case up front
+        if os.path.getsize(hist_file) == 0:
+            raise pd.errors.EmptyDataError("No columns to parse from file")
+        # The files are small and already read in parallel, so keep Arrow single threaded
+        read_options = pv.ReadOptions(use_threads=False)
+        try:
+            convert_options = pv.ConvertOptions(include_columns=columns, column_types={'datetime': pa.timestamp('ns')})
+            table = pv.read_csv(hist_file, read_options=read_options, convert_options=convert_options)
+        except pa.ArrowInvalid:
+            # Dates Arrow can't parse itself are left to pandas
+            convert_options = pv.ConvertOptions(include_columns=columns, column_types={'datetime': pa.string()})
+            table = pv.read_csv(hist_file, read_options=read_options, convert_options=convert_options)
+            return pd.to_datetime(table.column('datetime').to_pandas()).to_numpy(), table.column('close').to_numpy(zero_copy_only=False)
+    return table.column('datetime').to_numpy(), table.column('close').to_numpy(zero_copy_only=False)
+
+def load_price_range(hist_file):
+    """
+    Reads the first close within the lookback window and the last close from one historical file.
+    Module level so it can be sent to worker processes.
+
+    Args:
+        hist_file (Path): Path to the '{symbol}.parquet' or '{symbol}.csv' file.
+
+    Returns:
+        tuple: (start_price, end_price), or None if the file was skipped.
+    """
+    symbol = hist_file.stem # Get symbol from filename
+    try:
+        dates, close = read_price_history(hist_file)
+
+        if len(dates) < 2:
+            logging.warning(f"Skipping {symbol}: Not enough data in {hist_file.name}.")
+            return None
+
+        # Ensure data is sorted by date. Files are usually stored newest first,
+        # so a reverse is enough in the common case and a sort is rarely needed
+        if (dates[1:] >= dates[:-1]).all():
+            pass
+        elif (dates[1:] < dates[:-1]).all():
+            dates = dates[::-1]
+            close = close[::-1]
+        else:
+            order = np.argsort(dates, kind='stable')
+            dates = dates[order]
+            close = close[order]
+
+        # Find the earliest and latest data points within the approximate 12-month window
+        # (Data might not cover the full 365 days exactly)
+        end_date_target = dates[-1]
+        start_date_target = end_date_target - np.timedelta64(LOOKBACK_DAYS - 1, 'D') # Look back ~1 year from latest point
+
+        # The dates are sorted, so the first point on or after the start is a binary search away
+        # and the end point is simply the last row
+        start_idx = np.searchsorted(dates, start_date_target, side='left')
+        return close[start_idx], close[-1]
+
+    except pd.errors.EmptyDataError:
+         logging.warning(f"Skipping {symbol}: File is empty ({hist_file.name}).")
+    except (KeyError, ValueError) as e:
+         logging.warning(f"Skipping {symbol}: Missing expected column ('datetime' or 'close') in {hist_file.name}. Error: {e}")
+    except Exception as e:
+        logging.error(f"Error processing file {hist_file.name} for symbol {symbol}: {e}")
+    return None
+
+def calculate_performance(hist_dir, limit, output_file, max_workers=None):
+    """Calculates performance from downloaded historical files and saves top performers."""
     hist_path = Path(hist_dir)
     if not hist_path.is_dir():
         logging.error(f"Historical data directory not found: {hist_path}")
         return
 
-    logging.info(f"Calculating performance from CSV files in {hist_path}...")
+    logging.info(f"Calculating performance from historical files in {hist_path}...")
     results = []
-    processed_count = 0
     error_count = 0
 
-    csv_files = list(hist_path.glob('*.csv'))
-    total_files = len(csv_files)
-    logging.info(f"Found {total_files} CSV files to process.")
-
-    for i, csv_file in enumerate(csv_files):
-        symbol = csv_file.stem # Get symbol from filename
-        logging.debug(f"Processing file {i+1}/{total_files}: {csv_file.name}")
-
+    # os.scandir hands back DirEntry objects whose stat() is cached, so the summary check below
+    # needs no extra system call or Path object per file
+    with os.scandir(hist_path) as entries:
+        dir_entries = [entry for entry in entries if entry.is_file()]
+    hist_files = ([entry for entry in dir_entries if entry.name.endswith('.parquet')] +
+                  [entry for entry in dir_entries if entry.name.endswith('.csv')])
+    total_files = len(hist_files)
+    logging.info(f"Found {total_files} historical files to process.")
+
+    # Downloaded files don't change, so the price range of every file read last time is kept in a summary
+    # next to the directory, and only files that are new or modified since then are read again
+    summary_path = hist_path.parent / f"{hist_path.name}_summary.parquet"
+    file_mtimes = {entry.name: entry.stat().st_mtime_ns for entry in hist_files}
+    summary = {}
+    if summary_path.exists():
         try:
-            df = pd.read_csv(csv_file, index_col='datetime', parse_dates=True)
-
-            if df.empty or len(df) < 2:
-                logging.warning(f"Skipping {symbol}: Not enough data in CSV.")
-                continue
-
-            # Ensure data is sorted by date
-            df.sort_index(inplace=True)
-
-            # Find the earliest and latest data points within the approximate 12-month window
-            # (Data might not cover the full 365 days exactly)
-            end_date_target = df.index.max()
-            start_date_target = end_date_target - pd.Timedelta(days=LOOKBACK_DAYS - 1) # Look back ~1 year from latest point
-
-            # Find closest available points
-            start_data = df[df.index >= start_date_target]
-            end_data = df[df.index <= end_date_target] # Should just be the last point
-
-            if start_data.empty or end_data.empty:
-                 logging.warning(f"Skipping {symbol}: Could not find data points within the ~12 month range.")
-                 continue
-
-            start_price_row = start_data.iloc[0]
-            end_price_row = end_data.iloc[-1]
-
-            start_price = start_price_row['close']
-            end_price = end_price_row['close']
-
-            if pd.isna(start_price) or pd.isna(end_price) or start_price == 0 or start_price < 0:
-                logging.warning(f"Skipping {symbol}: Invalid start/end price (Start: {start_price}, End: {end_price})")
-                continue
-
-            increase_percent = ((end_price - start_price) / start_price) * 100
-            results.append({'symbol': symbol, 'increase_pct': increase_percent})
-            processed_count += 1
+            for row in pd.read_parquet(summary_path).itertuples(index=False):
+                if file_mtimes.get(row.file) == row.mtime_ns:
+                    summary[row.file] = row
+        except Exception as e:
+            logging.warning(f"Failed to load performance summary {summary_path}: {e}. Reading every file.")
+    # The largest files go first, so the last workers to finish aren't left with a big file each
+    stale_files = [Path(entry.path) for entry in sorted((entry for entry in hist_files if entry.name not in summary),
+                                                        key=lambda entry: entry.stat().st_size, reverse=True)]
+    logging.info(f"Reusing {len(summary)} results from {summary_path}, reading {len(stale_files)} files.")
+
+    if stale_files:
+        # Every file is independent and parsing them is CPU bound, so spread them over processes
+        workers = max(1, min(max_workers or os.cpu_count() or 1, len(stale_files)))
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            price_ranges = executor.map(load_price_range, stale_files, chunksize=64)
+
+            for i, (hist_file, price_range) in enumerate(zip(stale_files, price_ranges)):
+                logging.debug(f"Processed file {i+1}/{len(stale_files)}: {hist_file.name}")
+                # Skipped files are remembered too, so they aren't read again until they change
+                start_price, end_price = price_range if price_range is not None else (np.nan, np.nan)
+                summary[hist_file.name] = SummaryRow(hist_file.name, file_mtimes[hist_file.name],
+                                                     start_price, end_price, price_range is None)
 
-        except pd.errors.EmptyDataError:
-             logging.warning(f"Skipping {symbol}: CSV file is empty ({csv_file.name}).")
-             error_count += 1
-        except KeyError as e:
-             logging.warning(f"Skipping {symbol}: Missing expected column ('datetime' or 'close') in {csv_file.name}. Error: {e}")
-             error_count += 1
+        try:
+            summary_df = pd.DataFrame(list(summary.values()), columns=SummaryRow._fields)
+            summary_df[['start_price', 'end_price']] = summary_df[['start_price', 'end_price']].apply(pd.to_numeric, errors='coerce')
+            summary_df.to_parquet(summary_path, compression='zstd', index=False)
         except Exception as e:
-            logging.error(f"Error processing file {csv_file.name} for symbol {symbol}: {e}")
+            logging.error(f"Failed to save performance summary {summary_path}: {e}")
+
+    for entry in hist_files:
+        row = summary[entry.name]
+        if row.skipped:
             error_count += 1
+            continue
+        results.append((os.path.splitext(entry.name)[0], row.start_price, row.end_price))
+
+    # Check the prices and work out the increase for every file at once
+    results_df = pd.DataFrame(results, columns=['symbol', 'start_price', 'end_price'])
+    start_price = pd.to_numeric(results_df['start_price'], errors='coerce').to_numpy(dtype=np.float64)
+    end_price = pd.to_numeric(results_df['end_price'], errors='coerce').to_numpy(dtype=np.float64)
+    valid_prices = ~np.isnan(start_price) & ~np.isnan(end_price) & (start_price > 0)
+    for symbol, start, end in results_df.loc[~valid_prices, ['symbol', 'start_price', 'end_price']].itertuples(index=False):
+        logging.warning(f"Skipping {symbol}: Invalid start/end price (Start: {start}, End: {end})")
+    with np.errstate(divide='ignore', invalid='ignore'):
+        increase_pct = (end_price - start_price) / start_price * 100
+    results_df = pd.DataFrame({'symbol': results_df['symbol'].to_numpy()[valid_prices],
+                               'increase_pct': increase_pct[valid_prices]})
+    processed_count = len(results_df)
 
     logging.info(f"Calculation process finished.")
     logging.info(f"Successfully Calculated: {processed_count}")
     logging.info(f"Errors/Skipped during calculation: {error_count}")
 
-    if not results:
+    if results_df.empty:
         logging.error("No valid performance results were calculated.")
         return
 
-    # Sort and filter results
-    results_df = pd.DataFrame(results)
-    results_df['increase_pct'] = pd.to_numeric(results_df['increase_pct'], errors='coerce')
-    results_df.dropna(subset=['increase_pct'], inplace=True)
-    sorted_df = results_df.sort_values(by='increase_pct', ascending=False)
-    top_performers = sorted_df.head(limit)
+    # Select the top results, only the `limit` largest need ordering rather than every symbol
+    top_performers = results_df.nlargest(limit, 'increase_pct')
 
     logging.info(f"Selected top {len(top_performers)} performers.")
 
@@ -363,14 +523,15 @@ def main():
 
     try:
         if args.mode == 'download':
-            api_key = load_api_key()
-            td = TDClient(apikey=api_key)
-            stock_list = get_stock_list(td, args.exchanges, args.use_cache)
-            if not stock_list:
-                logging.error("Failed to retrieve stock list. Exiting.")
-                return 1
-            logging.info(f"Retrieved {len(stock_list)} unique stock symbols for download.")
-            download_historical_data(td, stock_list, args.hist_dir)
+            with queue_logging():
+                api_key = load_api_key()
+                td = create_td_client(api_key)
+                stock_list = get_stock_list(td, args.exchanges, args.use_cache)
+                if not stock_list:
+                    logging.error("Failed to retrieve stock list. Exiting.")
+                    return 1
+                logging.info(f"Retrieved {len(stock_list)} unique stock symbols for download.")
+                download_historical_data(td, stock_list, args.hist_dir, progress=args.progress)
 
         elif args.mode == 'calculate':
             calculate_performance(args.hist_dir, args.limit, args.output)
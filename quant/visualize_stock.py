@@ -3,7 +3,7 @@
 visualize_stock.py - Creates a candlestick chart for stock data.
 
 Usage:
-    python quant/visualize_stock.py [--input INPUT_CSV] [--output OUTPUT_PNG]
+    python quant/visualize_stock.py [--input INPUT_FILE] [--output OUTPUT_PNG]
 
 Example:
     python quant/visualize_stock.py --input quant/data/msft_data.csv --output quant/data/msft_visualization.png
@@ -11,7 +11,11 @@ Example:
 
 import os
 import argparse
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pv
+import pyarrow.parquet as pq
 import mplfinance as mpf
 import matplotlib
 
@@ -22,46 +26,73 @@ def parse_arguments():
     """Parse command-line arguments."""
     parser = argparse.ArgumentParser(description='Generate a candlestick chart for stock data.')
     parser.add_argument('--input', type=str, default='quant/data/msft_data.csv',
-                        help='Input CSV filename (default: quant/data/msft_data.csv)')
+                        help='Input CSV or Parquet filename (default: quant/data/msft_data.csv)')
     parser.add_argument('--output', type=str, default='quant/data/msft_visualization.png',
                         help='Output PNG filename (default: quant/data/msft_visualization.png)')
     parser.add_argument('--symbol', type=str, default='MSFT',
                         help='Stock symbol for the chart title (default: MSFT)')
     return parser.parse_args()
 
+def moving_average(values, window):
+    """Trailing mean over `window` points, NaN until the window is full, as rolling(window).mean() gives."""
+    values = np.asarray(values, dtype=np.float64)
+    if np.isnan(values).any():
+        # A gap would carry through the running sum, rolling skips it for the windows after it
+        return pd.Series(values).rolling(window=window).mean().to_numpy()
+    # Each window's sum is the difference of two running sums, one pass however long the window
+    sums = np.concatenate(([0.0], np.cumsum(values)))
+    averages = np.full(len(values), np.nan)
+    if len(values) >= window:
+        averages[window - 1:] = (sums[window:] - sums[:-window]) / window
+    return averages
+
+def read_stock_table(input_file):
+    """Read a CSV or Parquet stock file into an Arrow table."""
+    if os.path.splitext(input_file)[1].lower() in ('.parquet', '.pq'):
+        # stock_data.py saves parquet with datetime as the index, which is stored as an ordinary column
+        return pq.read_table(input_file)
+    return pv.read_csv(input_file)
+
 def prepare_data(csv_file):
-    """Read and prepare the stock data from a CSV file."""
+    """Read and prepare the stock data from a CSV or Parquet file."""
+    # The data stays in Arrow until the end, pandas is only needed because mplfinance takes a DataFrame
     try:
-        df = pd.read_csv(csv_file)
+        table = read_stock_table(csv_file)
     except FileNotFoundError:
         print(f"ERROR: Input file not found at {csv_file}")
         return None
 
     # Ensure required columns exist
     required_columns = ['datetime', 'open', 'high', 'low', 'close', 'volume']
-    if not all(col in df.columns for col in required_columns):
+    if not all(col in table.column_names for col in required_columns):
         print(f"ERROR: Input CSV must contain columns: {', '.join(required_columns)}")
         return None
 
-    # Convert datetime to proper format and set as index
+    # Convert datetime to proper format, Arrow has already parsed ISO dates and pandas parses anything else
     try:
-        df['datetime'] = pd.to_datetime(df['datetime'])
-        df.set_index('datetime', inplace=True)
+        datetime_type = table.schema.field('datetime').type
+        if pa.types.is_timestamp(datetime_type):
+            dates = table['datetime'].cast(pa.timestamp('ns', tz=datetime_type.tz))
+        elif pa.types.is_date(datetime_type):
+            dates = table['datetime'].cast(pa.timestamp('ns'))
+        else:
+            dates = pa.array(pd.to_datetime(table['datetime'].to_pandas()))
+        table = table.set_column(table.schema.get_field_index('datetime'), 'datetime', dates)
     except Exception as e:
         print(f"ERROR: Could not parse datetime column: {e}")
         return None
 
     # Sort data chronologically (oldest to newest)
-    df.sort_index(inplace=True)
+    table = table.sort_by('datetime')
 
     # Calculate moving averages
-    df['MA20'] = df['close'].rolling(window=20).mean()
-    df['MA50'] = df['close'].rolling(window=50).mean()
+    close = table['close'].to_numpy()
+    df = table.to_pandas(ignore_metadata=True).set_index('datetime')
+    df['MA20'] = moving_average(close, 20)
+    df['MA50'] = moving_average(close, 50)
 
     # Drop rows with NaN values created by rolling function
-    df.dropna(inplace=True)
-
-    return df
+    return df.dropna()
 
 def create_visualization(df, output_file, symbol):
     """Create and save the candlestick visualization."""
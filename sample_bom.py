@@ -25,7 +25,10 @@ import os
 import pickle
 from contextlib import nullcontext
 import random
+import numpy as np
 import torch
+# keep tiktoken's downloaded BPE files somewhere that survives a reboot, its default is the temp dir
+os.environ.setdefault("TIKTOKEN_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "tiktoken"))
 import tiktoken
 from model import GPTConfig, GPT
 
@@ -48,101 +51,132 @@ max_new_tokens = 2048  # number of tokens generated in each sample
 
 temperature = .8
 top_k = 300  # retain only the top_k most likely tokens, clamp others to have 0 probability
+# how the top_k cutoff is found, 'topk' or 'kthvalue'. on cpu torch.topk is quick for a small k (~64 or less),
+# for a larger k 'kthvalue' selects the cutoff without sorting. a top_k at or above the vocab size skips the crop
+top_k_method = 'topk'
 seed = random.randint(0, 10000)
 #seed = 1337
 device = 'cuda'  # examples: 'cpu', 'cuda', 'cuda:0', 'cuda:1', etc.
 dtype = 'bfloat16' if torch.cuda.is_bf16_supported(
 ) else 'float16'  # 'float32' or 'bfloat16' or 'float16'
 compile = False  # use PyTorch 2.0 to compile the model to be faster
-# overrides from command line or config file
-exec(open('configurator.py').read())
 # -----------------------------------------------------------------------------
 
-torch.manual_seed(seed)
-torch.cuda.manual_seed(seed)
-torch.backends.cuda.matmul.allow_tf32 = True  # allow tf32 on matmul
-torch.backends.cudnn.allow_tf32 = True  # allow tf32 on cudnn
-# for later use in torch.autocast
-device_type = 'cuda' if 'cuda' in device else 'cpu'
-ptdtype = {'float32': torch.float32,
-           'bfloat16': torch.bfloat16, 'float16': torch.float16}[dtype]
-ctx = nullcontext() if device_type == 'cpu' else torch.amp.autocast(
-    device_type=device_type, dtype=ptdtype)
-
-# model
-if init_from == 'resume':
-    # init from a model saved in a specific directory
-    ckpt_path = os.path.join(out_dir, 'ckpt.pt')
-    checkpoint = torch.load(ckpt_path, map_location=device)
-    gptconf = GPTConfig(**checkpoint['model_args'])
-    model = GPT(gptconf)
-    state_dict = checkpoint['model']
-    unwanted_prefix = '_orig_mod.'
-    for k, v in list(state_dict.items()):
-        if k.startswith(unwanted_prefix):
-            state_dict[k[len(unwanted_prefix):]] = state_dict.pop(k)
-    model.load_state_dict(state_dict)
-elif init_from.startswith('gpt2'):
-    # init from a given GPT-2 model
-    model = GPT.from_pretrained(init_from, dict(dropout=0.0))
-
-model.eval()
-model.to(device)
-if compile:
-    model = torch.compile(model)  # requires PyTorch 2.0 (optional)
-
-# look for the meta pickle in case it is available in the dataset folder
-load_meta = False
-# older checkpoints might not have these...
-if init_from == 'resume' and 'config' in checkpoint and 'dataset' in checkpoint['config']:
-    meta_path = os.path.join(
-        'data', checkpoint['config']['dataset'], 'meta.pkl')
-    load_meta = os.path.exists(meta_path)
-if load_meta:
-    print(f"Loading meta from {meta_path}...")
-    with open(meta_path, 'rb') as f:
-        meta = pickle.load(f)
-    # TODO want to make this more general to arbitrary encoder/decoder schemes
-    stoi, itos = meta['stoi'], meta['itos']
-    def encode(s_inptut):
-        result_ids = []
-        splits =s_inptut.split(' ')
-        for s in splits:
+# loaded models and their encoders, keyed by out_dir, so repeated in-process runs skip the checkpoint load
+model_cache = {}
+
+def load_model(out_dir, model_cache=model_cache):
+    if out_dir in model_cache:
+        return model_cache[out_dir]
+
+    # model
+    if init_from == 'resume':
+        # init from a model saved in a specific directory
+        ckpt_path = os.path.join(out_dir, 'ckpt.pt')
+        checkpoint = torch.load(ckpt_path, map_location=device)
+        gptconf = GPTConfig(**checkpoint['model_args'])
+        model = GPT(gptconf)
+        state_dict = checkpoint['model']
+        unwanted_prefix = '_orig_mod.'
+        for k, v in list(state_dict.items()):
+            if k.startswith(unwanted_prefix):
+                state_dict[k[len(unwanted_prefix):]] = state_dict.pop(k)
+        model.load_state_dict(state_dict)
+    elif init_from.startswith('gpt2'):
+        # init from a given GPT-2 model
+        model = GPT.from_pretrained(init_from, dict(dropout=0.0))
+
+    model.eval()
+    model.to(device)
+    if compile:
+        model = torch.compile(model)  # requires PyTorch 2.0 (optional)
+
+    # look for the meta pickle in case it is available in the dataset folder
+    load_meta = False
+    # older checkpoints might not have these...
+    if init_from == 'resume' and 'config' in checkpoint and 'dataset' in checkpoint['config']:
+        meta_path = os.path.join(
+            'data', checkpoint['config']['dataset'], 'meta.pkl')
+        load_meta = os.path.exists(meta_path)
+    if load_meta:
+        print(f"Loading meta from {meta_path}...")
+        with open(meta_path, 'rb') as f:
+            meta = pickle.load(f)
+        # TODO want to make this more general to arbitrary encoder/decoder schemes
+        stoi, itos = meta['stoi'], meta['itos']
+        def encode(s_inptut):
+            result_ids = []
+            splits =s_inptut.split(' ')
+            for s in splits:
+                
+                if '\n' in s:
+                    s = s.replace('\n', '')
+                    result_ids.append(stoi['\n'])
+                
+                if s == '':
+                    continue
+                result_ids.append(stoi[s])                     
+            return result_ids
             
-            if '\n' in s:
-                s = s.replace('\n', '')
-                result_ids.append(stoi['\n'])
-            
-            if s == '':
-                continue
-            result_ids.append(stoi[s])                     
-        return result_ids
-        
-    def decode(l): return ' '.join([itos[i] for i in l])
-else:
-    # ok let's assume gpt-2 encodings by default
-    print("No meta.pkl found, assuming GPT-2 encodings...")
-    enc = tiktoken.get_encoding("gpt2")
-    def encode(s): return enc.encode(s, allowed_special={"<|endoftext|>"})
-    def decode(l): return enc.decode(l)
-
-# encode the beginning of the prompt
-if start.startswith('FILE:'):
-    with open(start[5:], 'r', encoding='utf-8') as f:
-        start = f.read()
-start_ids = encode(start)
-x = (torch.tensor(start_ids, dtype=torch.long, device=device)[None, ...])
-
-# run generation
-with torch.no_grad():
-    with ctx:
-        for k in range(num_samples):
-            y = model.generate(x, max_new_tokens,
-                               temperature=temperature, top_k=top_k)
-            print(y[0].tolist())
-            decoded = decode(y[0].tolist())
-            if save_to is not None and save_to != '':
-                with open(save_to, 'w', encoding='utf-8') as f:
-                    f.write(decoded)
-            print(decoded)
-            print('---------------')
+        def decode(l): return ' '.join([itos[i] for i in l])
+    else:
+        # ok let's assume gpt-2 encodings by default
+        print("No meta.pkl found, assuming GPT-2 encodings...")
+        enc = tiktoken.get_encoding("gpt2")
+        def encode(s):
+            # the plain encoder skips the special token handling when there is no special token to find
+            if "<|endoftext|>" in s:
+                return enc.encode(s, allowed_special={"<|endoftext|>"})
+            return enc.encode_ordinary(s)
+        def decode(l): return enc.decode(l)
+
+    model_cache[out_dir] = (model, encode, decode)
+    return model_cache[out_dir]
+
+def run(out_dir=out_dir, start=start, save_to=save_to, model_cache=model_cache, seed=None):
+    # a fresh random seed per run unless one is given, as when each run was its own process
+    seed = random.randint(0, 10000) if seed is None else seed
+    torch.manual_seed(seed)
+    torch.cuda.manual_seed(seed)
+    torch.backends.cuda.matmul.allow_tf32 = True  # allow tf32 on matmul
+    torch.backends.cudnn.allow_tf32 = True  # allow tf32 on cudnn
+    if hasattr(torch.backends.cuda, 'enable_flash_sdp'):
+        torch.backends.cuda.enable_flash_sdp(True)  # let scaled_dot_product_attention pick the flash kernel
+    # for later use in torch.autocast
+    device_type = 'cuda' if 'cuda' in device else 'cpu'
+    ptdtype = {'float32': torch.float32,
+               'bfloat16': torch.bfloat16, 'float16': torch.float16}[dtype]
+    ctx = nullcontext() if device_type == 'cpu' else torch.amp.autocast(
+        device_type=device_type, dtype=ptdtype)
+
+    model, encode, decode = load_model(out_dir, model_cache)
+
+    # encode the beginning of the prompt
+    if start.startswith('FILE:'):
+        with open(start[5:], 'r', encoding='utf-8') as f:
+            start = f.read()
+    start_ids = encode(start)
+    # wrap the ids in a tensor without another copy, and on cuda copy them over from pinned memory
+    x = torch.from_numpy(np.fromiter(start_ids, dtype=np.int64, count=len(start_ids)))
+    x = (x.pin_memory().to(device, non_blocking=True) if device_type == 'cuda' else x.to(device))[None, ...]
+
+    # run generation
+    decoded = None
+    with torch.no_grad():
+        with ctx:
+            for k in range(num_samples):
+                y = model.generate(x, max_new_tokens,
+                                   temperature=temperature, top_k=top_k, top_k_method=top_k_method)
+                print(y[0].tolist())
+                decoded = decode(y[0].tolist())
+                if save_to is not None and save_to != '':
+                    with open(save_to, 'w', encoding='utf-8') as f:
+                        f.write(decoded)
+                print(decoded)
+                print('---------------')
+    return decoded
+
+if __name__ == "__main__":
+    # overrides from command line or config file
+    exec(open('configurator.py').read())
+    run(out_dir, start, save_to, seed=seed)
@@ -7,38 +7,40 @@ import numpy as np
 from pandas.testing import assert_frame_equal
 
 # Adjust import path
-from quant.data_preparation.anomaly_handler import handle_missing_trading_days, adjust_prices_for_splits_dividends
+from quant.data_preparation.anomaly_handler import handle_missing_trading_days, adjust_prices_for_splits_dividends, interpolate_within_blocks, us_business_days
 
 # --- Fixtures ---
 
-@pytest.fixture
+@pytest.fixture(scope='module') # Built once, tests pass the SUT a .copy()
 def sample_stock_data():
     """Creates a sample DataFrame with potential missing days."""
-    dates = pd.to_datetime([
+    dates = np.asarray([
         '2023-01-03', '2023-01-04', '2023-01-06', # Missing Jan 5th (Thu)
         '2023-01-09', '2023-01-10', '2023-01-13', # Missing Jan 11th, 12th (Wed, Thu)
         '2023-01-03', '2023-01-04', '2023-01-05', # Stock 2 has no missing days initially
-    ])
+    ], dtype='datetime64[ns]')
+    # Typed numpy columns and a categorical stock_id, as load_csv_data hands them over
     data = {
-        'open':   [10, 11, 13, 14, 15, 18, 50, 51, 52],
-        'high':   [10.5, 11.5, 13.5, 14.5, 15.5, 18.5, 50.5, 51.5, 52.5],
-        'low':    [9.5, 10.5, 12.5, 13.5, 14.5, 17.5, 49.5, 50.5, 51.5],
-        'close':  [10.2, 11.2, 13.2, 14.2, 15.2, 18.2, 50.2, 51.2, 52.2],
-        'volume': [100, 110, 130, 140, 150, 180, 200, 210, 220],
-        'stock_id': ['TEST1'] * 6 + ['TEST2'] * 3
+        'open':   np.asarray([10, 11, 13, 14, 15, 18, 50, 51, 52], dtype=np.int64),
+        'high':   np.asarray([10.5, 11.5, 13.5, 14.5, 15.5, 18.5, 50.5, 51.5, 52.5], dtype=np.float64),
+        'low':    np.asarray([9.5, 10.5, 12.5, 13.5, 14.5, 17.5, 49.5, 50.5, 51.5], dtype=np.float64),
+        'close':  np.asarray([10.2, 11.2, 13.2, 14.2, 15.2, 18.2, 50.2, 51.2, 52.2], dtype=np.float64),
+        'volume': np.asarray([100, 110, 130, 140, 150, 180, 200, 210, 220], dtype=np.int64),
+        'stock_id': pd.Categorical.from_codes(np.r_[np.zeros(6, dtype=np.int8), np.ones(3, dtype=np.int8)], categories=['TEST1', 'TEST2'])
     }
-    df = pd.DataFrame(data, index=dates)
-    df.index.name = 'datetime'
+    df = pd.DataFrame(data, index=pd.DatetimeIndex(dates, name='datetime'))
     df.sort_index(inplace=True) # Ensure sorted for processing
     return df
 
-@pytest.fixture
+@pytest.fixture(scope='module') # Built once, tests pass the SUT a .copy()
 def data_no_missing_days():
     """Creates sample data with no missing business days."""
-    dates = pd.to_datetime(['2023-01-03', '2023-01-04', '2023-01-05'])
-    data = {'open': [50, 51, 52], 'close': [50.2, 51.2, 52.2], 'volume': [200, 210, 220], 'stock_id': ['TEST3'] * 3}
-    df = pd.DataFrame(data, index=dates)
-    df.index.name = 'datetime'
+    dates = np.asarray(['2023-01-03', '2023-01-04', '2023-01-05'], dtype='datetime64[ns]')
+    data = {'open': np.asarray([50, 51, 52], dtype=np.int64),
+            'close': np.asarray([50.2, 51.2, 52.2], dtype=np.float64),
+            'volume': np.asarray([200, 210, 220], dtype=np.int64),
+            'stock_id': pd.Categorical.from_codes(np.zeros(3, dtype=np.int8), categories=['TEST3'])}
+    df = pd.DataFrame(data, index=pd.DatetimeIndex(dates, name='datetime'))
     # Add other required columns
     df['high'] = df['close'] + 0.5
     df['low'] = df['close'] - 0.5
@@ -124,6 +126,28 @@ def test_handle_missing_days_single_stock_all_missing():
     assert pd.Timestamp('2023-01-09') in filled_df.index
 
 
+def test_interpolate_within_blocks_stays_inside_block():
+    """Test interpolation never reads across a stock boundary."""
+    values = np.array([1.0, np.nan, 3.0, np.nan, np.nan, 10.0, np.nan, np.nan])
+    block_starts = np.array([0, 0, 0, 0, 3, 3, 3, 7])
+    block_ends = np.array([4, 4, 4, 4, 7, 7, 7, 8])
+    filled = interpolate_within_blocks(values, block_starts, block_ends, np.ones(len(values), dtype=bool))
+    # Interior gap interpolated, trailing gap forward filled, leading gap back filled, all-NaN block left alone
+    np.testing.assert_array_equal(filled, [1.0, 2.0, 3.0, 3.0, 10.0, 10.0, 10.0, np.nan])
+
+
+def test_us_business_days_matches_custom_business_day():
+    """Test the numpy business day calendar gives the same dates as a CustomBusinessDay range."""
+    from pandas.tseries.holiday import USFederalHolidayCalendar
+    from pandas.tseries.offsets import CustomBusinessDay
+    start, end = pd.Timestamp('2022-12-20'), pd.Timestamp('2024-01-10') # Spans Christmas, New Year, MLK day, ...
+    expected = pd.date_range(start, end, freq=CustomBusinessDay(calendar=USFederalHolidayCalendar()))
+    business_days = us_business_days(start, end)
+    assert business_days.equals(expected)
+    assert pd.Timestamp('2023-01-02') not in business_days # New Year's Day (observed)
+    assert pd.Timestamp('2023-01-16') not in business_days # MLK day
+
+
 # --- Tests for adjust_prices_for_splits_dividends (Placeholder) ---
 
 def test_adjust_prices_placeholder(sample_stock_data):
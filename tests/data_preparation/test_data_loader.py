@@ -13,11 +13,11 @@ from quant.data_preparation.data_utils import load_csv_data
 
 # --- Fixtures ---
 
-@pytest.fixture
-def temp_data_dir(tmp_path):
-    """Creates a temporary directory and populates it with sample CSV files."""
-    data_dir = tmp_path / "hist_data"
-    data_dir.mkdir()
+@pytest.fixture(scope='module')
+def temp_data_dir(tmp_path_factory):
+    """Creates a temporary directory and populates it with sample CSV files.
+    Shared by the module's tests, which only read from it."""
+    data_dir = tmp_path_factory.mktemp("hist_data")
 
     # Valid file 1 (AAPL)
     aapl_path = data_dir / "AAPL.csv"
@@ -68,6 +68,18 @@ def test_load_csv_data_valid(temp_data_dir):
     assert df.index.name == 'datetime'
     # Check sorting (oldest first)
     assert df.index.tolist() == [pd.Timestamp('2023-01-03'), pd.Timestamp('2023-01-04'), pd.Timestamp('2023-01-05')]
+    # Check downcast dtypes
+    assert (df[['open', 'high', 'low', 'close']].dtypes == 'float32').all()
+    assert pd.api.types.is_unsigned_integer_dtype(df['volume'])
+
+def test_load_csv_data_parquet(temp_data_dir, tmp_path):
+    """Test loading a Parquet file gives the same result as the CSV it was written from."""
+    csv_df = load_csv_data(temp_data_dir / "AAPL.csv", "AAPL")
+    file_path = tmp_path / "AAPL.parquet" # Outside the shared directory, which the other tests list
+    pd.read_csv(temp_data_dir / "AAPL.csv", index_col='datetime', parse_dates=True).to_parquet(file_path)
+    df = load_csv_data(file_path, "AAPL")
+    assert df is not None
+    pd.testing.assert_frame_equal(df, csv_df)
 
 def test_load_csv_data_nonexistent():
     """Test loading a non-existent file."""
@@ -16,20 +16,20 @@ from quant.data_preparation.feature_engineer import (
 
 # --- Fixtures ---
 
-@pytest.fixture
+@pytest.fixture(scope='module') # Built once, tests pass the SUT a .copy()
 def sample_feature_data():
     """Creates a sample DataFrame suitable for feature engineering tests."""
-    dates = pd.to_datetime([
+    dates = np.asarray([
         '2023-01-03', '2023-01-04', '2023-01-05', '2023-01-06', '2023-01-09',
         '2023-01-03', '2023-01-04', '2023-01-05', '2023-01-06', '2023-01-09',
-    ])
+    ], dtype='datetime64[ns]')
+    # Typed numpy columns and a categorical stock_id, as the loader hands them over
     data = {
-        'close':  [100, 101, 102, 101.5, 103, 50, 50.5, 51, 50.8, 51.2],
-        'volume': [1000, 1100, 1050, 1200, 1150, 500, 550, 600, 580, 620],
-        'stock_id': ['TESTA'] * 5 + ['TESTB'] * 5
+        'close':  np.asarray([100, 101, 102, 101.5, 103, 50, 50.5, 51, 50.8, 51.2], dtype=np.float64),
+        'volume': np.asarray([1000, 1100, 1050, 1200, 1150, 500, 550, 600, 580, 620], dtype=np.int64),
+        'stock_id': pd.Categorical.from_codes(np.repeat(np.arange(2, dtype=np.int8), 5), categories=['TESTA', 'TESTB'])
     }
-    df = pd.DataFrame(data, index=dates)
-    df.index.name = 'datetime'
+    df = pd.DataFrame(data, index=pd.DatetimeIndex(dates, name='datetime'))
     # Add other required columns if needed by future feature functions
     df['open'] = df['close'] - 1
     df['high'] = df['close'] + 1
@@ -45,18 +45,30 @@ def test_calculate_daily_returns(sample_feature_data):
     df = calculate_daily_returns(sample_feature_data.copy())
     assert 'daily_return' in df.columns
 
-    # Check TESTA returns (data is sorted by stock_id, datetime in fixture)
-    testa_returns = df[df['stock_id'] == 'TESTA']['daily_return']
-    assert pd.isna(testa_returns.iloc[0]) # First return is NaN
-    assert np.isclose(testa_returns.iloc[1], (101 - 100) / 100) # 0.01
-    assert np.isclose(testa_returns.iloc[2], (102 - 101) / 101)
-    assert np.isclose(testa_returns.iloc[3], (101.5 - 102) / 102)
-    assert np.isclose(testa_returns.iloc[4], (103 - 101.5) / 101.5)
+    # Check TESTA returns (data is sorted by stock_id, datetime in fixture), the first return is NaN
+    testa_returns = df.loc[df['stock_id'] == 'TESTA', 'daily_return'].to_numpy()
+    np.testing.assert_allclose(testa_returns, [np.nan, (101 - 100) / 100, (102 - 101) / 101,
+                                               (101.5 - 102) / 102, (103 - 101.5) / 101.5], rtol=1e-7)
 
     # Check TESTB returns
+    testb_returns = df.loc[df['stock_id'] == 'TESTB', 'daily_return'].to_numpy()
+    np.testing.assert_allclose(testb_returns, [np.nan, (50.5 - 50) / 50, (51 - 50.5) / 50.5,
+                                               (50.8 - 51) / 51, (51.2 - 50.8) / 50.8], rtol=1e-7)
+
+def test_calculate_daily_returns_with_gaps(sample_feature_data):
+    """Test that a missing close is bridged within its stock but never from the previous stock."""
+    df = sample_feature_data.copy()
+    df['close'] = df['close'].astype(float)
+    df.iloc[2, df.columns.get_loc('close')] = np.nan # TESTA 2023-01-05
+    df.iloc[5, df.columns.get_loc('close')] = np.nan # TESTB's first row
+    df = calculate_daily_returns(df)
+
+    testa_returns = df[df['stock_id'] == 'TESTA']['daily_return']
+    assert np.isclose(testa_returns.iloc[2], 0) # Gap carries 101 forward
+    assert np.isclose(testa_returns.iloc[3], (101.5 - 101) / 101)
+
     testb_returns = df[df['stock_id'] == 'TESTB']['daily_return']
-    assert pd.isna(testb_returns.iloc[0]) # First return is NaN
-    assert np.isclose(testb_returns.iloc[1], (50.5 - 50) / 50) # 0.01
+    assert testb_returns.iloc[:2].isna().all() # Nothing to carry from TESTA
     assert np.isclose(testb_returns.iloc[2], (51 - 50.5) / 50.5)
 
 def test_calculate_moving_averages(sample_feature_data):
@@ -66,23 +78,17 @@ def test_calculate_moving_averages(sample_feature_data):
     assert 'MA_2' in df.columns
     assert 'MA_3' in df.columns
 
-    # Check TESTA MAs (using min_periods=1 as in implementation)
-    testa_close = df[df['stock_id'] == 'TESTA']['close']
-    testa_ma2 = df[df['stock_id'] == 'TESTA']['MA_2']
-    testa_ma3 = df[df['stock_id'] == 'TESTA']['MA_3']
-    assert np.isclose(testa_ma2.iloc[0], 100) # MA2[0] = close[0]
-    assert np.isclose(testa_ma2.iloc[1], (100 + 101) / 2) # MA2[1] = (close[0]+close[1])/2
-    assert np.isclose(testa_ma2.iloc[2], (101 + 102) / 2) # MA2[2] = (close[1]+close[2])/2
-    assert np.isclose(testa_ma3.iloc[0], 100) # MA3[0] = close[0]
-    assert np.isclose(testa_ma3.iloc[1], (100 + 101) / 2) # MA3[1] = (close[0]+close[1])/2
-    assert np.isclose(testa_ma3.iloc[2], (100 + 101 + 102) / 3) # MA3[2] = (close[0]+close[1]+close[2])/3
-    assert np.isclose(testa_ma3.iloc[3], (101 + 102 + 101.5) / 3) # MA3[3] = (close[1]+close[2]+close[3])/3
+    # Check TESTA MAs (using min_periods=1 as in implementation, so MA[0] = close[0])
+    testa = df[df['stock_id'] == 'TESTA']
+    np.testing.assert_allclose(testa['MA_2'].to_numpy(), [100, (100 + 101) / 2, (101 + 102) / 2,
+                                                          (102 + 101.5) / 2, (101.5 + 103) / 2], rtol=1e-7)
+    np.testing.assert_allclose(testa['MA_3'].to_numpy(), [100, (100 + 101) / 2, (100 + 101 + 102) / 3,
+                                                          (101 + 102 + 101.5) / 3, (102 + 101.5 + 103) / 3], rtol=1e-7)
 
     # Check TESTB MAs
-    testb_close = df[df['stock_id'] == 'TESTB']['close']
-    testb_ma2 = df[df['stock_id'] == 'TESTB']['MA_2']
-    assert np.isclose(testb_ma2.iloc[0], 50)
-    assert np.isclose(testb_ma2.iloc[1], (50 + 50.5) / 2)
+    testb = df[df['stock_id'] == 'TESTB']
+    np.testing.assert_allclose(testb['MA_2'].to_numpy(), [50, (50 + 50.5) / 2, (50.5 + 51) / 2,
+                                                          (51 + 50.8) / 2, (50.8 + 51.2) / 2], rtol=1e-7)
 
 def test_calculate_volume_indicators(sample_feature_data):
     """Test volume indicator calculation (average volume)."""
@@ -92,19 +98,14 @@ def test_calculate_volume_indicators(sample_feature_data):
     assert col_name in df.columns
 
     # Check TESTA avg volume
-    testa_vol = df[df['stock_id'] == 'TESTA']['volume']
-    testa_avg_vol = df[df['stock_id'] == 'TESTA'][col_name]
-    assert np.isclose(testa_avg_vol.iloc[0], 1000)
-    assert np.isclose(testa_avg_vol.iloc[1], (1000 + 1100) / 2)
-    assert np.isclose(testa_avg_vol.iloc[2], (1000 + 1100 + 1050) / 3)
-    assert np.isclose(testa_avg_vol.iloc[3], (1100 + 1050 + 1200) / 3)
+    testa_avg_vol = df.loc[df['stock_id'] == 'TESTA', col_name].to_numpy()
+    np.testing.assert_allclose(testa_avg_vol, [1000, (1000 + 1100) / 2, (1000 + 1100 + 1050) / 3,
+                                               (1100 + 1050 + 1200) / 3, (1050 + 1200 + 1150) / 3], rtol=1e-7)
 
     # Check TESTB avg volume
-    testb_vol = df[df['stock_id'] == 'TESTB']['volume']
-    testb_avg_vol = df[df['stock_id'] == 'TESTB'][col_name]
-    assert np.isclose(testb_avg_vol.iloc[0], 500)
-    assert np.isclose(testb_avg_vol.iloc[1], (500 + 550) / 2)
-    assert np.isclose(testb_avg_vol.iloc[2], (500 + 550 + 600) / 3)
+    testb_avg_vol = df.loc[df['stock_id'] == 'TESTB', col_name].to_numpy()
+    np.testing.assert_allclose(testb_avg_vol, [500, (500 + 550) / 2, (500 + 550 + 600) / 3,
+                                               (550 + 600 + 580) / 3, (600 + 580 + 620) / 3], rtol=1e-7)
 
 # --- Test for the main engineer_features function ---
 
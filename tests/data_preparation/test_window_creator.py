@@ -11,7 +11,7 @@ from quant.data_preparation.window_creator import create_target, create_windows_
 
 # --- Fixtures ---
 
-@pytest.fixture
+@pytest.fixture(scope='module') # Built once, tests pass the SUT a .copy()
 def sample_window_data():
     """Creates a longer sample DataFrame for windowing and target tests."""
     # Create enough data for several windows + target lookahead
@@ -19,39 +19,32 @@ def sample_window_data():
     stock1_dates = dates[:20] # Stock 1 has 20 days (Jan 2 to Jan 27)
     stock2_dates = dates[5:25] # Stock 2 has 20 days (Jan 9 to Feb 3)
 
-    data1 = {
-        'close': np.linspace(10, 19.5, 20), # Simple increasing trend for Stock 1
-        'stock_id': ['STOCK1'] * 20
-    }
-    df1 = pd.DataFrame(data1, index=stock1_dates)
-
-    data2 = {
-        'close': np.linspace(50, 40.5, 20), # Simple decreasing trend for Stock 2
-        'stock_id': ['STOCK2'] * 20
-    }
-    df2 = pd.DataFrame(data2, index=stock2_dates)
-
-    df = pd.concat([df1, df2])
-    df.index.name = 'datetime'
-
-    # Add other necessary columns (can be simple for testing windowing logic)
-    df['open'] = df['close'] - 0.1
-    df['high'] = df['close'] + 0.1
-    df['low'] = df['close'] - 0.1
-    df['volume'] = 1000
+    # Build the frame once from arrays: a simple increasing trend for Stock 1 and a decreasing one for Stock 2
+    close = np.concatenate([np.linspace(10, 19.5, 20), np.linspace(50, 40.5, 20)])
+    df = pd.DataFrame({
+        'close': close,
+        'stock_id': np.repeat(['STOCK1', 'STOCK2'], 20).astype(object),
+        # Other necessary columns (can be simple for testing windowing logic)
+        'open': close - 0.1,
+        'high': close + 0.1,
+        'low': close - 0.1,
+        'volume': 1000,
+    }, index=stock1_dates.append(stock2_dates).rename('datetime'))
+
     # Add dummy features - assume they are already calculated and non-NaN for valid windows
-    # Ensure sorting before calculating features
-    df.sort_values(['stock_id', df.index.name], inplace=True)
-    df['MA_5'] = df.groupby('stock_id')['close'].transform(lambda x: x.rolling(5, min_periods=1).mean())
-    df['daily_return'] = df.groupby('stock_id')['close'].transform(lambda x: x.pct_change())
+    # The stocks were laid out in order, so the frame is already sorted by stock_id, datetime.
+    # Native groupby rolling/pct_change rather than a per-group transform(lambda). The rolling result
+    # comes back in row order (dates repeat across stocks, so don't align on them)
+    df['MA_5'] = df.groupby('stock_id', sort=False)['close'].rolling(5, min_periods=1).mean().to_numpy()
+    df['daily_return'] = df.groupby('stock_id', sort=False)['close'].pct_change()
     df['avg_volume_7'] = 1000 # Keep it simple
 
     # Introduce a NaN feature value in one potential window to test skipping
-    # Apply NaN *after* sorting and feature calculation
+    # Apply NaN *after* feature calculation
     nan_date_stock1 = df[df['stock_id'] == 'STOCK1'].index[8] # 9th day for STOCK1
     df.loc[nan_date_stock1, 'MA_5'] = np.nan
 
-    df.sort_index(inplace=True) # Sort back by date for overall consistency if needed
+    df.sort_index(kind='stable', inplace=True) # The only sort: by date, each date's stocks stay in order
     return df
 
 # --- Tests for create_target ---
@@ -62,9 +55,11 @@ def test_create_target_calculation(sample_window_data):
     df = create_target(sample_window_data.copy(), prediction_days=prediction_days) # df is now sorted by stock_id, datetime
 
     assert 'target' in df.columns
+    stocks = dict(list(df.groupby('stock_id', sort=False, observed=True))) # One pass instead of a mask per stock
+    assert all(stock_df.index.is_unique for stock_df in stocks.values()) # .at below needs one row per date
 
     # STOCK1: Generally increasing, target should mostly be 1
-    stock1_df = df[df['stock_id'] == 'STOCK1']
+    stock1_df = stocks['STOCK1']
     stock1_target_dropna = stock1_df.dropna(subset=['target']) # Drop NaNs at the end
     assert not stock1_target_dropna.empty, "STOCK1 should have some valid targets"
     # Check a specific point where target should be 1
@@ -73,50 +68,51 @@ def test_create_target_calculation(sample_window_data):
     target_date1_min = pred_date1 + pd.Timedelta(days=prediction_days)
     # Find target date within STOCK1's data
     actual_target_date1 = stock1_df[stock1_df.index >= target_date1_min].index.min()
-    # Use .loc with boolean indexing for safety with potential duplicate dates across stocks
-    # Use .item() to extract scalar value assuming unique date per stock
-    close_pred1 = stock1_df.loc[stock1_df.index == pred_date1, 'close'].item()
-    close_target1 = stock1_df.loc[stock1_df.index == actual_target_date1, 'close'].item()
+    # Dates repeat across stocks but not within one, so the per-stock frames support scalar .at lookups
+    close_pred1 = stock1_df.at[pred_date1, 'close']
+    close_target1 = stock1_df.at[actual_target_date1, 'close']
     expected_target1 = 1 if close_target1 > close_pred1 else 0
-    assert stock1_df.loc[stock1_df.index == pred_date1, 'target'].item() == expected_target1
+    assert stock1_df.at[pred_date1, 'target'] == expected_target1
     assert expected_target1 == 1 # Based on linspace data
 
     # STOCK2: Generally decreasing, target should mostly be 0
-    stock2_df = df[df['stock_id'] == 'STOCK2']
+    stock2_df = stocks['STOCK2']
     stock2_target_dropna = stock2_df.dropna(subset=['target'])
     assert not stock2_target_dropna.empty, "STOCK2 should have some valid targets"
     # Example: Predict from 2023-01-10, look at close on or after 2023-01-17
     pred_date2 = pd.Timestamp('2023-01-10')
     target_date2_min = pred_date2 + pd.Timedelta(days=prediction_days)
     actual_target_date2 = stock2_df[stock2_df.index >= target_date2_min].index.min()
-    close_pred2 = stock2_df.loc[stock2_df.index == pred_date2, 'close'].item()
-    close_target2 = stock2_df.loc[stock2_df.index == actual_target_date2, 'close'].item()
+    close_pred2 = stock2_df.at[pred_date2, 'close']
+    close_target2 = stock2_df.at[actual_target_date2, 'close']
     expected_target2 = 1 if close_target2 > close_pred2 else 0
-    assert stock2_df.loc[stock2_df.index == pred_date2, 'target'].item() == expected_target2
+    assert stock2_df.at[pred_date2, 'target'] == expected_target2
     assert expected_target2 == 0 # Based on linspace data
 
 def test_create_target_edge_cases(sample_window_data):
     """Test target calculation near the end of the data where lookahead fails."""
     prediction_days = 7
     df = create_target(sample_window_data.copy(), prediction_days=prediction_days)
+    stocks = dict(list(df.groupby('stock_id', sort=False, observed=True)))
+    assert all(stock_df.index.is_unique for stock_df in stocks.values()) # .at below needs one row per date
 
     # Check STOCK1 near the end
-    stock1_df = df[df['stock_id'] == 'STOCK1']
+    stock1_df = stocks['STOCK1']
     last_date_s1 = stock1_df.index.max()
     # Dates within `prediction_days` of the end should have NaN target
     cutoff_date_s1 = last_date_s1 - pd.Timedelta(days=prediction_days - 1) # Approx cutoff
     assert stock1_df[stock1_df.index > cutoff_date_s1]['target'].isna().all()
     # Check a date just before the cutoff has a valid target
     valid_target_date_s1 = stock1_df[stock1_df.index <= cutoff_date_s1].index[-1]
-    assert not pd.isna(stock1_df.loc[stock1_df.index == valid_target_date_s1, 'target'].item()), f"Target for {valid_target_date_s1} should not be NaN"
+    assert not pd.isna(stock1_df.at[valid_target_date_s1, 'target']), f"Target for {valid_target_date_s1} should not be NaN"
 
     # Check STOCK2 near the end
-    stock2_df = df[df['stock_id'] == 'STOCK2']
+    stock2_df = stocks['STOCK2']
     last_date_s2 = stock2_df.index.max()
     cutoff_date_s2 = last_date_s2 - pd.Timedelta(days=prediction_days - 1)
     assert stock2_df[stock2_df.index > cutoff_date_s2]['target'].isna().all()
     valid_target_date_s2 = stock2_df[stock2_df.index <= cutoff_date_s2].index[-1]
-    assert not pd.isna(stock2_df.loc[stock2_df.index == valid_target_date_s2, 'target'].item()), f"Target for {valid_target_date_s2} should not be NaN"
+    assert not pd.isna(stock2_df.at[valid_target_date_s2, 'target']), f"Target for {valid_target_date_s2} should not be NaN"
 
 
 # --- Tests for create_windows_and_target ---
@@ -212,20 +208,16 @@ def test_create_windows_skips_nan_target(sample_window_data):
 
     assert windowed_df is not None
     # Check that no windows exist *for the specific stock* for prediction dates where the target was NaN
-    overlapping_s1 = windowed_df[(windowed_df['prediction_date'].isin(nan_target_pred_dates_s1)) & (windowed_df['stock_id'] == 'STOCK1')]
-    overlapping_s2 = windowed_df[(windowed_df['prediction_date'].isin(nan_target_pred_dates_s2)) & (windowed_df['stock_id'] == 'STOCK2')]
-
-    print(f"\nDEBUG: Dates with NaN target for STOCK1: {nan_target_pred_dates_s1.tolist()}")
-    print(f"DEBUG: Prediction dates present in windowed_df for STOCK1: {windowed_df[windowed_df['stock_id']=='STOCK1']['prediction_date'].unique().tolist()}")
-    print(f"DEBUG: Overlapping dates for STOCK1: {overlapping_s1['prediction_date'].unique().tolist()}")
-
-    print(f"\nDEBUG: Dates with NaN target for STOCK2: {nan_target_pred_dates_s2.tolist()}")
-    print(f"DEBUG: Prediction dates present in windowed_df for STOCK2: {windowed_df[windowed_df['stock_id']=='STOCK2']['prediction_date'].unique().tolist()}")
-    print(f"DEBUG: Overlapping dates for STOCK2: {overlapping_s2['prediction_date'].unique().tolist()}")
-
-
-    assert overlapping_s1.empty, "Windows found for STOCK1 with NaN target"
-    assert overlapping_s2.empty, "Windows found for STOCK2 with NaN target"
+    # Encode the prediction dates once and match on integer codes (a date missing from the windows gets -1, which no row has)
+    prediction_dates = pd.Categorical(windowed_df['prediction_date'])
+    has_nan_target_s1 = np.isin(prediction_dates.codes, prediction_dates.categories.get_indexer(nan_target_pred_dates_s1))
+    has_nan_target_s2 = np.isin(prediction_dates.codes, prediction_dates.categories.get_indexer(nan_target_pred_dates_s2))
+    overlapping_s1 = windowed_df[has_nan_target_s1 & (windowed_df['stock_id'] == 'STOCK1')]
+    overlapping_s2 = windowed_df[has_nan_target_s2 & (windowed_df['stock_id'] == 'STOCK2')]
+
+    # The messages are only built when an assert fails
+    assert overlapping_s1.empty, f"Windows found for STOCK1 with NaN target: {overlapping_s1['prediction_date'].unique().tolist()}"
+    assert overlapping_s2.empty, f"Windows found for STOCK2 with NaN target: {overlapping_s2['prediction_date'].unique().tolist()}"
 
 
 def test_create_windows_insufficient_data():
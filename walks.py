@@ -1,7 +1,6 @@
-from math import dist
+import argparse
+import numpy as np
 from numpy import random
-from operator import add
-import plotille
 import secrets
 
 trials = 1000
@@ -12,46 +11,48 @@ experiment_success_bar = 85 # in [0, 255], lower is better
 
 start = (70, 70)
 good = (95, 95)
-max = (100, 100)
+max_point = (100, 100)
 
 rng = random.default_rng(secrets.randbits(128))
 
-def incline(p, step, step_limit, max):
-    limits = tuple(map(lambda d: 0 if d[1] > 98 else (d[0] - d[1]) // step_limit + 1, zip(max, p)))
-    return tuple(map(min, zip(step, limits)))
-
-def prioritize_x(item):
-    return item[0] * 10 + item[1]
-
-def prioritize_y(item):
-    return item[1] * 10 + item[0]
-
-def walks(trials, steps, step_limit, start, max, t):
-    end_points = []
-    for _ in range (0, trials):
-        p = start
-        backlog = list(rng.integers(-step_limit, step_limit, (steps * backlog_multiplier, 2), endpoint=True))
-        for _ in range(0, steps):
-            if p[0] < p[1]:
-                backlog.sort(reverse=True, key=prioritize_x)
-            else:
-                backlog.sort(reverse=True, key=prioritize_y)
-            h = backlog.pop(0)
-            e = tuple(map(add, p, incline(p, h, step_limit, max))) if rng.bytes(1)[0] > experiment_success_bar else p
-            p = e if t(p, e, max) else p
-            if p == max:
-                break
-        end_points.append(p)
-    return end_points
-
-end_points_three = walks(trials, steps, step_limit, start, max, lambda a, b, c: dist(b, c) < dist(a, c))
-
-start_dist_three = list(map(lambda p: dist(start, p), end_points_three))
-max_dist_three = list(map(lambda p: dist(max, p), end_points_three))
-
-print()
+# All trials walk at once: points are (trials, 2) arrays, one row per trial
+
+def incline(p, step, step_limit, max_point):
+    limits = np.where(p > 98, 0, (np.asarray(max_point) - p) // step_limit + 1)
+    return np.minimum(step, limits)
+
+def prioritize_x(items):
+    return items[..., 0] * 10 + items[..., 1]
+
+def prioritize_y(items):
+    return items[..., 1] * 10 + items[..., 0]
+
+def walks(trials, steps, step_limit, start, max_point, t):
+    p = np.tile(np.asarray(start), (trials, 1))
+    backlog = rng.integers(-step_limit, step_limit, (trials, steps * backlog_multiplier, 2), endpoint=True)
+    # The keys never change, only which of them are still in the backlog
+    key_x = prioritize_x(backlog)
+    key_y = prioritize_y(backlog)
+    # One byte per trial and step decides whether that step's experiment succeeded
+    success = rng.integers(0, 256, (trials, steps), dtype=np.uint8) > experiment_success_bar
+    taken = np.zeros(key_x.shape, dtype=bool)
+    done = np.zeros(trials, dtype=bool)
+    rows = np.arange(trials)
+    for step in range(0, steps):
+        # Each trial takes its highest priority step left in the backlog (the head after sorting it)
+        keys = np.where((p[:, 0] < p[:, 1])[:, None], key_x, key_y)
+        keys[taken] = np.iinfo(keys.dtype).min
+        i = keys.argmax(axis=1)
+        taken[rows, i] = True
+        h = backlog[rows, i]
+        e = np.where(success[:, step, None], p + incline(p, h, step_limit, max_point), p)
+        # Trials that reached max_point have stopped
+        p = np.where((t(p, e, max_point) & ~done)[:, None], e, p)
+        done |= (p == max_point).all(axis=1)
+    return p
 
 def scatter_plot(label, points, start, good):
+    import plotille # Only needed to draw, the walks themselves don't use it
     print(label)
     fig = plotille.Figure()
     fig.width = 25
@@ -62,24 +63,46 @@ def scatter_plot(label, points, start, good):
     fig.y_label = 'm1'
     fig.origin = False
     fig.color_mode = 'names'
-    x, y = zip(*points)
-    fig.scatter(x, y)
+    fig.scatter(points[:, 0], points[:, 1])
     fig.scatter([start[0]], [start[1]], lc='blue')
     fig.scatter([good[0]], [good[1]], lc='green')
     print(fig.show())
     print()
 
-scatter_plot('WALKS THREE', end_points_three, start, good)
+_BINS = np.array([0.0, 5.0, 10.0, 15.0, 20.0, 25.0, 30.0, 35.0, 40.0, 45.0, 50.0, 55.0, 100.0])
+
+def histogram_counts(distances):
+    # Bucket every rounded distance by the bin edges (half to even, like round()), 100 and over go in the last bin
+    i = np.minimum(np.searchsorted(_BINS, np.rint(distances), side='right') - 1, len(_BINS) - 2)
+    return np.bincount(i, minlength=len(_BINS) - 1).tolist()
 
 def histogram(label, distances):
-    bins = [0.0, 5.0, 10.0, 15.0, 20.0, 25.0, 30.0, 35.0, 40.0, 45.0, 50.0, 55.0, 100.0]
-    counts = [0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0]
-    for d in distances:
-        i = round(d) // 5 if d < 55 else 11
-        counts[i] += 1
+    import plotille
     print(label)
-    print(plotille.hist_aggregated(counts, bins, width=25))
+    print(plotille.hist_aggregated(histogram_counts(distances), _BINS, width=25))
+    print()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Monte Carlo random walks from start towards the max point.')
+    parser.add_argument('--plot', action='store_true',
+                        help='Draw the end points and distance histograms with plotille (default: print the bin counts)')
+    args = parser.parse_args()
+
+    end_points_three = walks(trials, steps, step_limit, start, max_point,
+                             # Squared distances order the points the same way, without a sqrt
+                             lambda a, b, c: ((b - c) ** 2).sum(axis=1) < ((a - c) ** 2).sum(axis=1))
+
+    # Distances of every end point in one pass over each column
+    start_dist_three = np.hypot(*(end_points_three - start).T)
+    max_dist_three = np.hypot(*(end_points_three - max_point).T)
+
     print()
 
-histogram('WALKS THREE START DISTANCE', start_dist_three)
-histogram('WALKS THREE MAX DISTANCE', max_dist_three)
\ No newline at end of file
+    if args.plot:
+        scatter_plot('WALKS THREE', end_points_three, start, good)
+        histogram('WALKS THREE START DISTANCE', start_dist_three)
+        histogram('WALKS THREE MAX DISTANCE', max_dist_three)
+    else:
+        print('bins', _BINS.tolist())
+        print('WALKS THREE START DISTANCE', histogram_counts(start_dist_three))
+        print('WALKS THREE MAX DISTANCE', histogram_counts(max_dist_three))